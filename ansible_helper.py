@@ -1,7 +1,17 @@
 import subprocess
 import os
-import re, time
+import time
+import json
 import logging
+import tempfile
+
+from health_probe import probe_hosts
+from metrics import instrument
+
+try:
+    import ansible_runner
+except ImportError:
+    ansible_runner = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,69 +19,134 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-def ansible_ping(inventory_path, config_path, hosts = "all"):
-    cmd = ["ansible", hosts,"--ssh-common-args", f"-F {config_path}", "-i", inventory_path, "-m", "ping"]
-    return subprocess.run(cmd,
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        check=False
-    )
+def check_reachability(inventory_path, config_path, hosts="all", timeout=300, initial_delay=1, max_delay=15):
+    """
+    Wait until every host of an inventory group answers on SSH, retrying
+    after a delay that doubles up to `max_delay`.
 
-def check_reachability(inventory_path, config_path, check_reachable = 0, count = 2):
-    count = 0
+    Returns:
+        True when all hosts answered, False if some did not within `timeout` seconds.
+    """
+    started = time.monotonic()
+    delay = initial_delay
     while True:
-       
-        result = ansible_ping(inventory_path, config_path)
-        # print(result)
-        reachable = 0
-        unreachable = 0
-
-        for line in result.stdout.splitlines():
-            if re.search(r"SUCCESS", line):
-                reachable += 1
-            elif re.search(r"UNREACHABLE", line):
-                unreachable += 1
-                
-        logging.info("Reachable hosts: %d, Unreachable hosts: %d", reachable, unreachable)
-        if count > 2 and reachable == check_reachable:
-            logging.info("No reachable hosts found. Exiting.")
-            return False
-            exit(1)
-        if unreachable == 0:
+        # SSH is what the playbook needs next, so probe port 22 on every host.
+        unreachable_hosts, reachable_hosts = probe_hosts(
+            inventory_path, config_path, hosts=hosts, port=22, http=False
+        )
+        logging.info("Reachable hosts: %d, Unreachable hosts: %d", len(reachable_hosts), len(unreachable_hosts))
+        if not unreachable_hosts:
             logging.info("All hosts are reachable.")
             return True
-            exit(0)
-        if count > 10:
-            logging.info("Too many retries. Exiting.")
+        if time.monotonic() - started + delay > timeout:
+            logging.error("Hosts still unreachable after %d seconds: %s", timeout, ", ".join(unreachable_hosts))
             return False
-            exit(1)
-        logging.info("Retrying in 5 seconds...")
-        count +=1
-        time.sleep(5)
+        logging.info("Retrying in %d seconds...", delay)
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def _host_results(stats):
+    """
+    Turn Ansible play stats into host -> {"ok", "changed", "failed", "unreachable"}.
+    """
+    keys = {"ok": "ok", "changed": "changed", "failures": "failed", "dark": "unreachable", "unreachable": "unreachable"}
+    results = {}
+    for key, name in keys.items():
+        for host, value in (stats.get(key) or {}).items():
+            results.setdefault(host, {"ok": 0, "changed": 0, "failed": 0, "unreachable": 0})[name] += value
+    return results
+
+@instrument("ansible.playbook")
+def run_ansible_playbook(inventory_path, config_path, playbook_path, tags = [], limit = None, forks = None):
+    """
+    Run a playbook and return per-host results.
 
+    Uses ansible-runner in process when it is installed, otherwise
+    ansible-playbook with the JSON stdout callback.
 
-def run_ansible_playbook(inventory_path, config_path, playbook_path, tags = []):
-    cmd = ["ansible-playbook", "-i", inventory_path, "--ssh-common-args", f"-F {config_path}", playbook_path]
+    Returns:
+        dict host -> {"ok": n, "changed": n, "failed": n, "unreachable": n}
+    """
+    ssh_args = f"-F {config_path}"
+    if ansible_runner is not None:
+        with tempfile.TemporaryDirectory() as private_data_dir:
+            runner = ansible_runner.run(
+                private_data_dir=private_data_dir,
+                playbook=playbook_path,
+                inventory=inventory_path,
+                project_dir=os.path.dirname(playbook_path),
+                tags=",".join(tags) if tags else None,
+                limit=limit,
+                forks=forks,
+                cmdline=f"--ssh-common-args '{ssh_args}'",
+                quiet=True
+            )
+            return _host_results(runner.stats or {})
+
+    cmd = ["ansible-playbook", "-i", inventory_path, "--ssh-common-args", ssh_args, playbook_path]
     if len(tags) > 0:
         cmd += ["--tags", ",".join(tags)]
-    subprocess.run(cmd)
+    if limit:
+        cmd += ["--limit", limit]
+    if forks:
+        cmd += ["--forks", str(forks)]
+    result = subprocess.run(
+        cmd,
+        text=True,
+        stdout=subprocess.PIPE,
+        env=dict(os.environ, ANSIBLE_STDOUT_CALLBACK="json"),
+        check=False
+    )
+    try:
+        stats = json.loads(result.stdout).get("stats", {})
+    except ValueError:
+        logging.error("Could not parse ansible-playbook output (exit code %d).", result.returncode)
+        return {}
+    results = {}
+    for host, counts in stats.items():
+        results[host] = {
+            "ok": counts.get("ok", 0),
+            "changed": counts.get("changed", 0),
+            "failed": counts.get("failures", 0),
+            "unreachable": counts.get("unreachable", 0),
+        }
+    return results
+
+def run_incremental_playbook(inventory_path, config_path, playbook_path, new_hosts, refresh_lb=None, max_forks=50):
+    """
+    Configure only `new_hosts` with the webservers play, then refresh the load
+    balancer once by calling `refresh_lb(configured_hosts)`.
+
+    Returns:
+        (configured_hosts, failed_hosts) lists.
+    """
+    if not new_hosts:
+        return [], []
+    results = run_ansible_playbook(
+        inventory_path,
+        config_path,
+        playbook_path,
+        tags=["webservers"],
+        limit=",".join(new_hosts),
+        forks=max(1, min(len(new_hosts), max_forks))
+    )
+    failed_hosts = [
+        host for host in new_hosts
+        if host not in results or results[host]["failed"] or results[host]["unreachable"]
+    ]
+    configured_hosts = [host for host in new_hosts if host not in failed_hosts]
+    for host in failed_hosts:
+        logging.error("Configuration of %s failed: %s", host, results.get(host, "no result"))
+    logging.info("Configured %d of %d new hosts.", len(configured_hosts), len(new_hosts))
+    if refresh_lb is not None:
+        refresh_lb(configured_hosts)
+    return configured_hosts, failed_hosts
     
 def check_hosts_status(inventory_path, config_path):
-    result = ansible_ping(inventory_path, config_path, hosts="webservers")
-    unreachable_hosts = []
-    reachable_hosts = []
-    
-    for line in result.stdout.splitlines():
-        # Match UNREACHABLE lines
-        match_unreachable = re.search(r"(.*?) \| UNREACHABLE", line)
-        if match_unreachable:
-            host = match_unreachable.group(1).strip()
-            unreachable_hosts.append(host)
-
-        # Match SUCCESS lines
-        match_success = re.search(r"(.*?) \| SUCCESS", line)
-        if match_success:
-            host = match_success.group(1).strip()
-            reachable_hosts.append(host)
-    return unreachable_hosts, reachable_hosts
\ No newline at end of file
+    """
+    Probe the Flask app on every webserver concurrently through the bastion.
+    Returns (unreachable_hosts, reachable_hosts).
+    """
+    unreachable_hosts, reachable_hosts = probe_hosts(inventory_path, config_path, hosts="webservers")
+    return unreachable_hosts, reachable_hosts
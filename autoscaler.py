@@ -0,0 +1,95 @@
+import math
+import time
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class Autoscaler:
+    """
+    Turn HAProxy load into a desired webserver count.
+
+    Scale up when sessions per server exceed `target_sessions`, when requests
+    queue, or when the average response time exceeds `max_response_ms`. Scale
+    down only once the pool would still run below `scale_down_utilization` of
+    the target after shrinking (hysteresis). Cooldowns keep consecutive
+    decisions in the same direction apart.
+    """
+
+    def __init__(self, min_servers=1, max_servers=10, target_sessions=20, max_response_ms=500,
+                 scale_down_utilization=0.6, scale_up_cooldown=60, scale_down_cooldown=300):
+        self.min_servers = min_servers
+        self.max_servers = max_servers
+        self.target_sessions = target_sessions
+        self.max_response_ms = max_response_ms
+        self.scale_down_utilization = scale_down_utilization
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.last_scale_up = -math.inf
+        self.last_scale_down = -math.inf
+
+    def clamp(self, count):
+        return max(self.min_servers, min(self.max_servers, count))
+
+    def desired_count(self, stats, current):
+        """
+        Compute how many webservers the pool should have.
+
+        Args:
+            stats (dict): Output of read_backend_stats.
+            current (int): Number of webservers currently in rotation.
+        """
+        now = time.monotonic()
+        load = stats["sessions"] + stats["queue"]
+        needed = math.ceil(load / self.target_sessions)
+        if stats["queue"] > 0 or stats["response_ms"] > self.max_response_ms:
+            needed = max(needed, current + 1)
+
+        if needed > current:
+            if now - self.last_scale_up < self.scale_up_cooldown:
+                logging.info("Autoscaler wants %d servers but scale-up is cooling down.", needed)
+                return self.clamp(current)
+            desired = self.clamp(needed)
+            if desired > current:
+                self.last_scale_up = now
+                logging.info("Autoscaler: %d sessions, %d queued, %d ms -> scale up to %d.",
+                             stats["sessions"], stats["queue"], stats["response_ms"], desired)
+            return desired
+
+        shrink_to = math.ceil(load / (self.target_sessions * self.scale_down_utilization))
+        if shrink_to < current:
+            if now - self.last_scale_down < self.scale_down_cooldown:
+                return self.clamp(current)
+            desired = self.clamp(shrink_to)
+            if desired < current:
+                self.last_scale_down = now
+                logging.info("Autoscaler: %d sessions -> scale down to %d.", stats["sessions"], desired)
+            return desired
+        return self.clamp(current)
+
+
+def pick_scale_down_victims(hosts, count, stats=None):
+    """
+    Choose the `count` hosts to remove on scale-down: the least loaded ones
+    according to HAProxy (sessions plus queue), newest first among equals.
+    Hosts HAProxy does not know about carry no traffic and go first.
+
+    Args:
+        hosts (list): Candidate host names, e.g. "mytag_dev3".
+        stats (dict): Output of read_backend_stats, or None to pick by name only.
+    """
+    servers = (stats or {}).get("servers", {})
+
+    def load(host):
+        server = servers.get(host)
+        return server["sessions"] + server["queue"] if server else -1
+
+    def number(host):
+        digits = host.rsplit("dev", 1)[-1]
+        return int(digits) if digits.isdigit() else 0
+
+    return sorted(hosts, key=lambda host: (load(host), -number(host)))[:max(0, count)]
@@ -1,5 +1,12 @@
+import os
 import re
+import stat
+import hashlib
 import logging
+import tempfile
+
+from infrastructure import abs_path
+from health_probe import read_ssh_config
 
 logging.basicConfig(
     level=logging.INFO,
@@ -7,12 +14,99 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-def write_ansible_and_ssh_config(hosts_dict, tag, identity_file_path):
-    bastion_key = f"{tag}_bastion"
-    haproxy_key = f"{tag}_haproxy"
+def get_webserver_ips(hosts_dict, tag):
+    """
+    Return the webserver entries (e.g. "mytag_dev1") of a name -> IP dict.
+    """
     # Match keys like "mytag_dev1", "mytag_dev2", etc.
     dev_pattern = re.compile(rf"^{tag}_dev\d+$")
-    dev_keys = [key for key in hosts_dict if dev_pattern.match(key)]
+    return {key: ip for key, ip in hosts_dict.items() if dev_pattern.match(key)}
+
+def get_standby_ips(hosts_dict, tag):
+    """
+    Return the parked standby entries (e.g. "mytag_standby1") that have an IP.
+    """
+    standby_pattern = re.compile(rf"^{tag}_standby\d+$")
+    return {key: ip for key, ip in hosts_dict.items() if standby_pattern.match(key) and ip}
+
+def inventory_file():
+    return abs_path("./hosts")
+
+def ssh_config_file(tag):
+    return abs_path(f"./{tag}_config")
+
+def _write_if_changed(path, content):
+    """
+    Replace `path` with `content` through a temporary file and an atomic
+    rename, unless it already holds exactly that content. The file keeps
+    its previous mode, or gets 0644 when it is new.
+
+    Returns True if the file was written.
+    """
+    data = content.encode()
+    mode = 0o644
+    try:
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+            mode = stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates the file 0600.
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+def _normalise_ip(ip):
+    # A missing IP is written as "HostName None" and read back as a string.
+    return None if ip in (None, "", "None") else str(ip)
+
+def _diff_hosts(previous, current):
+    return {
+        "added": sorted(set(current) - set(previous)),
+        "removed": sorted(set(previous) - set(current)),
+        "changed": sorted(
+            name for name in set(previous) & set(current)
+            if _normalise_ip(previous[name]) != _normalise_ip(current[name])
+        ),
+    }
+
+def write_ansible_and_ssh_config(hosts_dict, tag, identity_file_path, inventory_path=None):
+    """
+    Write the Ansible inventory (the shared `hosts` unless `inventory_path`
+    is given) and SSH config for a tag into the project directory, only
+    touching the files whose content changed.
+
+    Standby servers go to their own [standby] group so the playbook can
+    configure them without HAProxy ever seeing them.
+
+    Returns:
+        dict with the "added", "removed" and "changed" host names compared
+        with the SSH config previously on disk, standbys excluded. All lists
+        are empty when the membership and addresses are unchanged.
+    """
+    hosts_path = inventory_path or inventory_file()
+    config_path = ssh_config_file(tag)
+    bastion_key = f"{tag}_bastion"
+    haproxy_key = f"{tag}_haproxy"
+    dev_keys = list(get_webserver_ips(hosts_dict, tag))
+    standby_keys = list(get_standby_ips(hosts_dict, tag))
+    standby_pattern = re.compile(rf"^{tag}_standby\d+$")
+    try:
+        previous = {
+            host: options.get("HostName")
+            for host, options in read_ssh_config(config_path).items()
+            if host != "*" and not standby_pattern.match(host)
+        }
+    except FileNotFoundError:
+        previous = {}
 
 
     # === Ansible Hosts File ===
@@ -25,12 +119,13 @@ def write_ansible_and_ssh_config(hosts_dict, tag, identity_file_path):
 [webservers]
 {chr(10).join(dev_keys)}
 
+[standby]
+{chr(10).join(standby_keys)}
+
 [all:vars]
 ansible_user=ubuntu
 """
 
-    with open("hosts", "w") as f:
-        f.write(hosts_file_content)
 
     # === SSH Config File ===
     config_file_content = f"""Host *
@@ -46,8 +141,8 @@ Host {bastion_key}
     HostName {hosts_dict[bastion_key]}
 """
 
-    # Add dev servers
-    for dev_key in dev_keys:
+    # Add dev and standby servers
+    for dev_key in dev_keys + standby_keys:
         config_file_content += f"""
 Host {dev_key}
     HostName {hosts_dict[dev_key]}
@@ -61,10 +156,19 @@ Host {haproxy_key}
     ProxyJump {bastion_key}
 """
 
-    with open(f"{tag}_config", "w") as f:
-        f.write(config_file_content)
-
-    logging.info(f"Files written: 'hosts' and '{tag}_config'")
+    written = [
+        os.path.basename(path)
+        for path, content in ((hosts_path, hosts_file_content), (config_path, config_file_content))
+        if _write_if_changed(path, content)
+    ]
+    current = {key: hosts_dict[key] for key in [bastion_key, haproxy_key] + dev_keys}
+    diff = _diff_hosts(previous, current)
+    if written:
+        logging.info(f"Files written: {', '.join(written)} (added: {diff['added']}, removed: {diff['removed']}, "
+                     f"changed: {diff['changed']})")
+    else:
+        logging.info(f"'hosts' and '{tag}_config' are up to date.")
+    return diff
 
 
 def extract_names_ips_from_server(total_servers, tag):
@@ -0,0 +1,145 @@
+import io
+import time
+import shlex
+import tarfile
+import logging
+import subprocess
+
+import jinja2
+
+from infrastructure import abs_path
+from metrics import instrument
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Deployed path -> (template, service reloaded when the file changes)
+LB_CONFIGS = {
+    "/etc/haproxy/haproxy.cfg": ("templete_files/haproxy.cfg.j2", "haproxy"),
+    "/etc/nginx/nginx.conf": ("templete_files/nginx.conf", "nginx"),
+}
+
+_FILE_MARKER = "__config_renderer_file_end__"
+_STAGING_DIR = "/tmp/lb-configs"
+
+# Last content pushed to each haproxy host by this process.
+_last_pushed = {}
+
+
+def render_lb_configs(webserver_ips, haproxy_host):
+    """
+    Render the HAProxy and Nginx configs from a webserver name -> IP dict.
+
+    The templates are the ones the playbook uses; the facts they read from
+    `hostvars` are filled in from the IPs we already know from OpenStack.
+    """
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(abs_path(".")),
+        trim_blocks=True,
+        keep_trailing_newline=True
+    )
+    context = {
+        "groups": {"webservers": list(webserver_ips), "haproxy": [haproxy_host]},
+        "hostvars": {
+            name: {"ansible_default_ipv4": {"address": ip}}
+            for name, ip in webserver_ips.items()
+        },
+    }
+    rendered = {}
+    for path, (template, _) in LB_CONFIGS.items():
+        with open(abs_path(template), newline="") as f:
+            source = f.read().replace("\r\n", "\n")
+        rendered[path] = env.from_string(source).render(**context)
+    return rendered
+
+
+def fetch_deployed_configs(config_path, haproxy_host, paths):
+    """
+    Read the deployed files from the haproxy host in one SSH session.
+    """
+    script = "; ".join(f"sudo cat {shlex.quote(path)}; echo {_FILE_MARKER}" for path in paths)
+    result = subprocess.run(
+        ["ssh", "-F", config_path, haproxy_host, script],
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=30,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ssh to {haproxy_host} failed: {result.stderr.strip()}")
+    contents = result.stdout.split(_FILE_MARKER + "\n")
+    return dict(zip(paths, contents))
+
+
+def _tar_files(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for path, content in files.items():
+            data = content.encode()
+            info = tarfile.TarInfo(path.lstrip("/"))
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@instrument("ssh.push_lb_configs")
+def push_lb_configs(config_path, haproxy_host, webserver_ips, reload_haproxy=True):
+    """
+    Render the load balancer configs locally and push only what changed.
+
+    Changed files travel as one tar archive over a single SSH session. They are
+    validated in a staging directory before being installed, then the matching
+    services are reloaded (HAProxy only when `reload_haproxy` is set, e.g. when
+    the runtime API could not be used).
+
+    Returns:
+        list of deployed paths that were updated.
+    """
+    rendered = render_lb_configs(webserver_ips, haproxy_host)
+    if _last_pushed.get(haproxy_host) == rendered and not reload_haproxy:
+        logging.info("Load balancer configs unchanged since last push.")
+        return []
+
+    deployed = fetch_deployed_configs(config_path, haproxy_host, list(rendered))
+    changed = {path: content for path, content in rendered.items() if deployed.get(path) != content}
+    if not changed and not reload_haproxy:
+        logging.info("Load balancer configs already up to date on %s.", haproxy_host)
+        _last_pushed[haproxy_host] = rendered
+        return []
+
+    commands = [f"rm -rf {_STAGING_DIR}", f"mkdir -p {_STAGING_DIR}", f"tar -xf - -C {_STAGING_DIR}"]
+    if "/etc/haproxy/haproxy.cfg" in changed:
+        commands.append(f"sudo haproxy -c -q -f {_STAGING_DIR}/etc/haproxy/haproxy.cfg")
+    if "/etc/nginx/nginx.conf" in changed:
+        commands.append(f"sudo nginx -t -q -c {_STAGING_DIR}/etc/nginx/nginx.conf")
+    for path in changed:
+        commands.append(f"sudo cp {_STAGING_DIR}{path} {path}")
+    services = {LB_CONFIGS[path][1] for path in changed}
+    if reload_haproxy:
+        services.add("haproxy")
+    elif "haproxy" in services:
+        # The runtime API already applied the change; the file only has to
+        # match it for the next restart.
+        services.remove("haproxy")
+    for service in sorted(services):
+        commands.append(f"sudo systemctl reload {service}")
+    result = subprocess.run(
+        ["ssh", "-F", config_path, haproxy_host, " && ".join(commands)],
+        input=_tar_files(changed),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=60,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Pushing configs to {haproxy_host} failed: {result.stderr.decode().strip()}")
+
+    _last_pushed[haproxy_host] = rendered
+    logging.info("Pushed %s to %s.", ", ".join(sorted(changed)), haproxy_host)
+    return sorted(changed)
@@ -0,0 +1,150 @@
+import time
+import logging
+import subprocess
+from collections import deque
+from datetime import datetime, timezone
+
+from health_probe import probe_addresses, read_ssh_config
+from haproxy_runtime import show_backend_servers
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Nova states in which a webserver cannot come back on its own.
+DEAD_STATUSES = ("ERROR", "SHUTOFF", "DELETED", "SOFT_DELETED")
+
+# HAProxy `srv_op_state` of a server its health checks consider down.
+HAPROXY_STOPPED = 0
+
+
+def server_age(server):
+    """
+    Seconds since Nova created `server`, or None when it does not say.
+    """
+    created_at = getattr(server, "created_at", None)
+    if not created_at:
+        return None
+    if isinstance(created_at, str):
+        try:
+            created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds()
+
+
+class CircuitBreaker:
+    """
+    Refuse server replacements while they look like churn rather than repair:
+
+    - when more than `max_fraction` of the pool fails at once, which is far
+      more likely a network blip between us and the pool than dead VMs,
+    - when more than `max_replacements` servers were replaced within the
+      last `window` seconds.
+
+    Once tripped it stays open for `cooldown` seconds.
+    """
+
+    def __init__(self, max_fraction=0.5, max_replacements=5, window=600, cooldown=300):
+        self.max_fraction = max_fraction
+        self.max_replacements = max_replacements
+        self.window = window
+        self.cooldown = cooldown
+        self._replaced_at = deque()
+        self._open_until = 0
+
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def _trip(self, reason):
+        self._open_until = time.monotonic() + self.cooldown
+        logging.warning("Circuit breaker open for %d seconds: %s", self.cooldown, reason)
+
+    def allow(self, count, pool_size):
+        """
+        Decide whether `count` of `pool_size` servers may be replaced now,
+        and record them if so.
+        """
+        now = time.monotonic()
+        if self.is_open():
+            return False
+        if pool_size and count > self.max_fraction * pool_size:
+            self._trip(f"{count} of {pool_size} servers failed at once")
+            return False
+        while self._replaced_at and now - self._replaced_at[0] > self.window:
+            self._replaced_at.popleft()
+        if len(self._replaced_at) + count > self.max_replacements:
+            self._trip(f"more than {self.max_replacements} replacements in {self.window} seconds")
+            return False
+        self._replaced_at.extend([now] * count)
+        return True
+
+
+def confirm_failures(cache, config_path, haproxy_host, bastion, suspects, grace_hosts=(), grace=600):
+    """
+    Decide which hosts that failed the probe are really dead, from three
+    independent signals:
+
+    - Nova: a server that is gone or in ERROR/SHUTOFF is dead outright,
+    - a second HTTP probe of the host through the bastion,
+    - the HAProxy health check state of the host.
+
+    An ACTIVE server is dead when the second probe fails too and HAProxy
+    does not see it up. When HAProxy cannot be asked, the two failed probes
+    decide.
+
+    ACTIVE servers created less than `grace` seconds ago, or named in
+    `grace_hosts` (e.g. standbys just promoted), may still be booting or
+    configuring and are never judged dead by the probes.
+
+    Returns:
+        (dead, servers) where dead lists the confirmed hosts and servers maps
+        them to their Nova server, or None when it no longer exists.
+    """
+    cache.refresh_servers(force=True)
+    servers = {name: cache.find_server(name) for name in suspects}
+
+    try:
+        lb_states = show_backend_servers(config_path, haproxy_host)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logging.warning("No HAProxy health state to confirm failures: %s", e)
+        lb_states = None
+
+    ssh_hosts = read_ssh_config(config_path)
+    active = [name for name, server in servers.items() if server and server.status not in DEAD_STATUSES]
+    young = set()
+    for name in active:
+        age = server_age(servers[name])
+        if name in grace_hosts or (age is not None and age < grace):
+            young.add(name)
+    active = [name for name in active if name not in young]
+    probed = probe_addresses(
+        config_path,
+        bastion,
+        {name: ssh_hosts.get(name, {}).get("HostName", name) for name in active}
+    )
+
+    dead = []
+    for name, server in servers.items():
+        if server is None or server.status in DEAD_STATUSES:
+            logging.warning("%s is dead: Nova reports %s.", name, server.status if server else "no server")
+            dead.append(name)
+            continue
+        if name in young:
+            logging.info("%s is still within its %d second grace period, keeping it.", name, grace)
+            continue
+        if probed.get(name):
+            logging.info("%s answered a second probe, keeping it.", name)
+            continue
+        lb_state = lb_states.get(name) if lb_states is not None else None
+        if lb_state is not None and lb_state["op_state"] != HAPROXY_STOPPED:
+            logging.info("%s failed two probes but HAProxy sees it up, keeping it.", name)
+            continue
+        logging.warning("%s is dead: failed two probes, HAProxy state %s.", name,
+                        "down" if lb_state else "unknown")
+        dead.append(name)
+    return dead, {name: servers[name] for name in dead}
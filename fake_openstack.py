@@ -0,0 +1,522 @@
+import time
+import uuid
+import threading
+import ipaddress
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class FakeResource:
+    """
+    Attribute bag standing in for an openstacksdk resource.
+    """
+
+    def __init__(self, **attrs):
+        attrs.setdefault("id", str(uuid.uuid4()))
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return f"FakeResource(name={getattr(self, 'name', None)!r}, id={self.id!r})"
+
+
+class FakeNotFound(Exception):
+    """
+    Stand-in for openstacksdk's NotFoundException.
+    """
+    status_code = 404
+
+
+class _FakeCloud:
+    """
+    Shared state and accounting behind the fake compute and network proxies.
+    """
+
+    def __init__(self, latency, boot_time, delete_time):
+        self.latency = latency
+        self.boot_time = boot_time
+        self.delete_time = delete_time
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.servers = {}
+        self.deleted_servers = {}
+        self.keypairs = {}
+        self.images = {}
+        self.flavors = {}
+        self.networks = {}
+        self.subnets = {}
+        self.routers = {}
+        self.ports = {}
+        self.floating_ips = {}
+        self.security_groups = {}
+        self.security_group_rules = {}
+        self._next_ip = {}
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def allocate_ip(self, subnet):
+        with self.lock:
+            hosts = self._next_ip.get(subnet.id)
+            if hosts is None:
+                hosts = self._next_ip[subnet.id] = ipaddress.ip_network(subnet.cidr).hosts()
+                next(hosts)  # the first address is the gateway
+            return str(next(hosts))
+
+
+def _find(resources, name_or_id):
+    for resource in resources.values():
+        if resource.id == name_or_id or getattr(resource, "name", None) == name_or_id:
+            return resource
+    return None
+
+
+def _matches(resource, filters):
+    return all(getattr(resource, key, None) == value for key, value in filters.items())
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class FakeCompute:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def find_server(self, name_or_id, ignore_missing=True):
+        self._cloud.call("compute.find_server")
+        return _find(self._cloud.servers, name_or_id)
+
+    def get_server(self, server):
+        self._cloud.call("compute.get_server")
+        server_id = getattr(server, "id", server)
+        return self._cloud.servers.get(server_id) or self._cloud.deleted_servers[server_id]
+
+    def servers(self, name=None, changes_since=None, **filters):
+        self._cloud.call("compute.servers")
+        prefix = name.lstrip("^") if name else ""
+        with self._cloud.lock:
+            servers = list(self._cloud.servers.values())
+            if changes_since:
+                since = datetime.strptime(changes_since, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+                servers = [s for s in servers + list(self._cloud.deleted_servers.values()) if s.updated_at >= since]
+        return [s for s in servers if s.name.startswith(prefix) and _matches(s, filters)]
+
+    def create_server(self, name, image_id, flavor_id, networks, key_name=None, security_groups=None,
+                      user_data=None, **attrs):
+        self._cloud.call("compute.create_server")
+        network = self._cloud.networks[networks[0]["uuid"]]
+        subnet = next(s for s in self._cloud.subnets.values() if s.network_id == network.id)
+        ip = self._cloud.allocate_ip(subnet)
+        server = FakeResource(
+            name=name,
+            status="BUILD",
+            image_id=image_id,
+            flavor_id=flavor_id,
+            key_name=key_name,
+            security_groups=security_groups or [],
+            metadata=attrs.get("metadata", {}),
+            addresses={network.name: [{"addr": ip, "version": 4, "OS-EXT-IPS:type": "fixed"}]},
+            ready_at=time.monotonic() + self._cloud.boot_time,
+            created_at=_now(),
+            updated_at=_now()
+        )
+        port = FakeResource(
+            name="",
+            network_id=network.id,
+            device_id=server.id,
+            device_owner="compute:nova",
+            fixed_ips=[{"subnet_id": subnet.id, "ip_address": ip}]
+        )
+        with self._cloud.lock:
+            self._cloud.servers[server.id] = server
+            self._cloud.ports[port.id] = port
+        return server
+
+    def wait_for_server(self, server, status="ACTIVE", failures=None, interval=2, wait=120):
+        self._cloud.call("compute.wait_for_server")
+        server = self._cloud.servers[server.id]
+        delay = server.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with self._cloud.lock:
+            if server.status != status:
+                server.status = status
+                server.updated_at = _now()
+        return server
+
+    def delete_server(self, server, ignore_missing=True, force=False):
+        self._cloud.call("compute.delete_server")
+        server_id = getattr(server, "id", server)
+        with self._cloud.lock:
+            server = self._cloud.servers.pop(server_id, None)
+            if server is None:
+                return None
+            server.status = "DELETED"
+            server.updated_at = _now()
+            server.deleted_at = time.monotonic() + self._cloud.delete_time
+            self._cloud.deleted_servers[server_id] = server
+            for port in [p for p in self._cloud.ports.values() if p.device_id == server_id]:
+                del self._cloud.ports[port.id]
+                for fip in self._cloud.floating_ips.values():
+                    if fip.port_id == port.id:
+                        fip.port_id = None
+
+    def wait_for_delete(self, server, interval=2, wait=120):
+        self._cloud.call("compute.wait_for_delete")
+        server = self._cloud.deleted_servers.get(getattr(server, "id", server))
+        if server is not None:
+            delay = server.deleted_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return server
+
+    def stop_server(self, server):
+        self._cloud.call("compute.stop_server")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            server.status = "SHUTOFF"
+            server.updated_at = _now()
+
+    def start_server(self, server):
+        self._cloud.call("compute.start_server")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            server.status = "ACTIVE"
+            server.updated_at = _now()
+
+    def shelve_server(self, server):
+        self._cloud.call("compute.shelve_server")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            server.status = "SHELVED_OFFLOADED"
+            server.updated_at = _now()
+
+    def unshelve_server(self, server):
+        self._cloud.call("compute.unshelve_server")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            server.status = "ACTIVE"
+            server.updated_at = _now()
+
+    def update_server(self, server, **attrs):
+        self._cloud.call("compute.update_server")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            for key, value in attrs.items():
+                setattr(server, key, value)
+            server.updated_at = _now()
+        return server
+
+    def set_server_metadata(self, server, **metadata):
+        self._cloud.call("compute.set_server_metadata")
+        with self._cloud.lock:
+            server = self._cloud.servers[server.id]
+            server.metadata.update(metadata)
+            server.updated_at = _now()
+        return server
+
+    def get_server_console_output(self, server, length=None):
+        self._cloud.call("compute.get_server_console_output")
+        server = self._cloud.servers[server.id]
+        if time.monotonic() >= server.ready_at:
+            return {"output": "Cloud-init v. 20.4 finished at now. Up 12.00 seconds\n"}
+        return {"output": ""}
+
+    def find_image(self, name_or_id, ignore_missing=True):
+        self._cloud.call("compute.find_image")
+        return _find(self._cloud.images, name_or_id)
+
+    def create_server_image(self, server, name, metadata=None, wait=False, timeout=120):
+        self._cloud.call("compute.create_server_image")
+        image = FakeResource(name=name)
+        with self._cloud.lock:
+            self._cloud.images[image.id] = image
+        return image
+
+    def find_flavor(self, name_or_id, ignore_missing=True):
+        self._cloud.call("compute.find_flavor")
+        return _find(self._cloud.flavors, name_or_id)
+
+    def find_keypair(self, name_or_id, ignore_missing=True):
+        self._cloud.call("compute.find_keypair")
+        return _find(self._cloud.keypairs, name_or_id)
+
+    def get_keypair(self, keypair):
+        self._cloud.call("compute.get_keypair")
+        return self._cloud.keypairs[getattr(keypair, "id", keypair)]
+
+    def keypairs(self):
+        self._cloud.call("compute.keypairs")
+        return list(self._cloud.keypairs.values())
+
+    def create_keypair(self, name, public_key=None):
+        self._cloud.call("compute.create_keypair")
+        # Nova keypairs are identified by name.
+        keypair = FakeResource(id=name, name=name, public_key=public_key)
+        with self._cloud.lock:
+            self._cloud.keypairs[keypair.id] = keypair
+        return keypair
+
+    def delete_keypair(self, keypair, ignore_missing=True):
+        self._cloud.call("compute.delete_keypair")
+        with self._cloud.lock:
+            self._cloud.keypairs.pop(getattr(keypair, "id", keypair), None)
+
+
+class FakeNetwork:
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def _create(self, kind, collection, **attrs):
+        self._cloud.call(f"network.create_{kind}")
+        resource = FakeResource(**attrs)
+        with self._cloud.lock:
+            collection[resource.id] = resource
+        return resource
+
+    def _delete(self, kind, collection, resource):
+        self._cloud.call(f"network.delete_{kind}")
+        with self._cloud.lock:
+            collection.pop(getattr(resource, "id", resource), None)
+
+    def _get(self, kind, collection, resource):
+        self._cloud.call(f"network.get_{kind}")
+        return collection[getattr(resource, "id", resource)]
+
+    def _list(self, kind, collection, filters):
+        self._cloud.call(f"network.{kind}")
+        with self._cloud.lock:
+            return [r for r in collection.values() if _matches(r, filters)]
+
+    def find_network(self, name_or_id, ignore_missing=True):
+        self._cloud.call("network.find_network")
+        return _find(self._cloud.networks, name_or_id)
+
+    def get_network(self, network):
+        return self._get("network", self._cloud.networks, network)
+
+    def networks(self, **filters):
+        return self._list("networks", self._cloud.networks, filters)
+
+    def create_network(self, name, **attrs):
+        return self._create("network", self._cloud.networks, name=name, **attrs)
+
+    def delete_network(self, network, ignore_missing=True):
+        self._delete("network", self._cloud.networks, network)
+
+    def find_subnet(self, name_or_id, ignore_missing=True):
+        self._cloud.call("network.find_subnet")
+        return _find(self._cloud.subnets, name_or_id)
+
+    def get_subnet(self, subnet):
+        return self._get("subnet", self._cloud.subnets, subnet)
+
+    def subnets(self, **filters):
+        return self._list("subnets", self._cloud.subnets, filters)
+
+    def create_subnet(self, name, network_id, cidr, **attrs):
+        return self._create("subnet", self._cloud.subnets, name=name, network_id=network_id, cidr=cidr, **attrs)
+
+    def delete_subnet(self, subnet, ignore_missing=True):
+        self._delete("subnet", self._cloud.subnets, subnet)
+
+    def find_router(self, name_or_id, ignore_missing=True):
+        self._cloud.call("network.find_router")
+        return _find(self._cloud.routers, name_or_id)
+
+    def get_router(self, router):
+        return self._get("router", self._cloud.routers, router)
+
+    def routers(self, **filters):
+        return self._list("routers", self._cloud.routers, filters)
+
+    def create_router(self, name, **attrs):
+        attrs.setdefault("external_gateway_info", None)
+        return self._create("router", self._cloud.routers, name=name, **attrs)
+
+    def update_router(self, router, **attrs):
+        self._cloud.call("network.update_router")
+        with self._cloud.lock:
+            router = self._cloud.routers[router.id]
+            router.__dict__.update(attrs)
+        return router
+
+    def add_interface_to_router(self, router, subnet_id=None, port_id=None):
+        self._cloud.call("network.add_interface_to_router")
+        subnet = self._cloud.subnets[subnet_id]
+        port = FakeResource(
+            name="",
+            network_id=subnet.network_id,
+            device_id=router.id,
+            device_owner="network:router_interface",
+            fixed_ips=[{"subnet_id": subnet.id, "ip_address": subnet.gateway_ip}]
+        )
+        with self._cloud.lock:
+            self._cloud.ports[port.id] = port
+
+    def remove_interface_from_router(self, router, subnet_id=None, port_id=None):
+        self._cloud.call("network.remove_interface_from_router")
+        with self._cloud.lock:
+            interfaces = [
+                port for port in self._cloud.ports.values()
+                if port.device_id == router.id and port.fixed_ips[0]["subnet_id"] == subnet_id
+            ]
+            if not interfaces:
+                raise FakeNotFound(f"Router {router.id} has no interface on subnet {subnet_id}.")
+            for port in interfaces:
+                del self._cloud.ports[port.id]
+
+    def delete_router(self, router, ignore_missing=True):
+        self._delete("router", self._cloud.routers, router)
+
+    def ports(self, **filters):
+        return self._list("ports", self._cloud.ports, filters)
+
+    def delete_port(self, port, ignore_missing=True):
+        self._delete("port", self._cloud.ports, port)
+
+    def ips(self, **filters):
+        return self._list("ips", self._cloud.floating_ips, filters)
+
+    def create_ip(self, floating_network_id, **attrs):
+        address = f"203.0.113.{len(self._cloud.floating_ips) % 250 + 1}"
+        return self._create("ip", self._cloud.floating_ips, floating_network_id=floating_network_id,
+                            floating_ip_address=address, port_id=None, **attrs)
+
+    def update_ip(self, floating_ip, **attrs):
+        self._cloud.call("network.update_ip")
+        with self._cloud.lock:
+            floating_ip = self._cloud.floating_ips[floating_ip.id]
+            floating_ip.__dict__.update(attrs)
+        return floating_ip
+
+    def delete_ip(self, floating_ip, ignore_missing=True):
+        self._delete("ip", self._cloud.floating_ips, floating_ip)
+
+    def find_security_group(self, name_or_id, ignore_missing=True):
+        self._cloud.call("network.find_security_group")
+        return _find(self._cloud.security_groups, name_or_id)
+
+    def get_security_group(self, security_group):
+        return self._get("security_group", self._cloud.security_groups, security_group)
+
+    def security_groups(self, **filters):
+        return self._list("security_groups", self._cloud.security_groups, filters)
+
+    def create_security_group(self, name, **attrs):
+        return self._create("security_group", self._cloud.security_groups, name=name, **attrs)
+
+    def delete_security_group(self, security_group, ignore_missing=True):
+        self._delete("security_group", self._cloud.security_groups, security_group)
+        with self._cloud.lock:
+            sg_id = getattr(security_group, "id", security_group)
+            for rule in list(self._cloud.security_group_rules.values()):
+                if sg_id in (rule.security_group_id, rule.remote_group_id):
+                    del self._cloud.security_group_rules[rule.id]
+
+    def security_group_rules(self, **filters):
+        return self._list("security_group_rules", self._cloud.security_group_rules, filters)
+
+    def create_security_group_rule(self, **attrs):
+        for key in ("port_range_min", "port_range_max", "remote_ip_prefix", "remote_group_id"):
+            attrs.setdefault(key, None)
+        return self._create("security_group_rule", self._cloud.security_group_rules, **attrs)
+
+    def create_security_group_rules(self, data):
+        self._cloud.call("network.create_security_group_rules")
+        rules = []
+        with self._cloud.lock:
+            for attrs in data:
+                attrs = dict(attrs)
+                for key in ("port_range_min", "port_range_max", "remote_ip_prefix", "remote_group_id"):
+                    attrs.setdefault(key, None)
+                rule = FakeResource(**attrs)
+                self._cloud.security_group_rules[rule.id] = rule
+                rules.append(rule)
+        return rules
+
+    def delete_security_group_rule(self, rule, ignore_missing=True):
+        self._delete("security_group_rule", self._cloud.security_group_rules, rule)
+
+
+class FakeConnection:
+    """
+    In-memory stand-in for `openstack.connect()` covering the compute and
+    network proxy calls this project makes.
+
+    Every call is counted in `calls` and costs `latency` seconds. Servers
+    take `boot_time` seconds to become ACTIVE and `delete_time` seconds to go
+    away. `tenant_size` unrelated servers are created up front so listings
+    cost what they would on a busy tenant.
+    """
+
+    def __init__(self, latency=0.0, boot_time=0.0, delete_time=0.0, tenant_size=0,
+                 image_name="Ubuntu 20.04 Focal Fossa x86_64", flavor_name="1C-4GB-100GB",
+                 external_network_name="ext-net"):
+        self._cloud = _FakeCloud(latency, boot_time, delete_time)
+        self.compute = FakeCompute(self._cloud)
+        self.network = FakeNetwork(self._cloud)
+
+        image = FakeResource(name=image_name)
+        flavor = FakeResource(name=flavor_name, vcpus=1)
+        self._cloud.images[image.id] = image
+        self._cloud.flavors[flavor.id] = flavor
+        ext_net = FakeResource(name=external_network_name)
+        self._cloud.networks[ext_net.id] = ext_net
+
+        if tenant_size:
+            other_net = FakeResource(name="othernetwork")
+            other_subnet = FakeResource(name="othersubnet", network_id=other_net.id, cidr="10.0.0.0/16",
+                                        gateway_ip="10.0.0.1")
+            self._cloud.networks[other_net.id] = other_net
+            self._cloud.subnets[other_subnet.id] = other_subnet
+            for i in range(tenant_size):
+                server = self.compute.create_server(
+                    name=f"other_server{i}",
+                    image_id=image.id,
+                    flavor_id=flavor.id,
+                    networks=[{"uuid": other_net.id}]
+                )
+                server.status = "ACTIVE"
+            self.reset_calls()
+
+    def active_server_names(self, prefix=""):
+        """
+        Names of the ACTIVE servers, read without going through the API
+        (stands in for hosts answering probes).
+        """
+        with self._cloud.lock:
+            return sorted(
+                server.name for server in self._cloud.servers.values()
+                if server.status == "ACTIVE" and server.name.startswith(prefix)
+            )
+
+    def failed_server_names(self, prefix=""):
+        """
+        Names of the servers put in a failed state, read without the API.
+        """
+        with self._cloud.lock:
+            return sorted(
+                server.name for server in self._cloud.servers.values()
+                if server.status in ("ERROR", "SHUTOFF") and server.name.startswith(prefix)
+            )
+
+    def fail_server(self, name, status="ERROR"):
+        """
+        Put a server in a failed state, as if its hypervisor lost it.
+        """
+        with self._cloud.lock:
+            server = next(s for s in self._cloud.servers.values() if s.name == name)
+            server.status = status
+            server.updated_at = _now()
+
+    @property
+    def calls(self):
+        return self._cloud.calls
+
+    def reset_calls(self):
+        with self._cloud.lock:
+            self._cloud.calls.clear()
@@ -1,11 +1,101 @@
-import subprocess
 import time
 import re
+import math
+import random
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+SERVING_PATTERN = re.compile(r"Serving from (\S+)")
+
 def normalize_host(hostname):
     return hostname.replace('-', '_')
 
+def misses_before_stop(seen_count, confidence):
+    """
+    Number of consecutive responses without a new backend after which we stop.
+
+    If one more backend existed it would get at least 1/(seen+1) of the
+    requests, so the chance of missing it for k requests in a row is at most
+    (seen/(seen+1))**k. Pick the smallest k that keeps this below 1-confidence.
+    """
+    if seen_count == 0:
+        return math.inf
+    return math.ceil(math.log(1 - confidence) / math.log(seen_count / (seen_count + 1)))
+
+def probe_haproxy_backends(url, expected_hosts=None, concurrency=8, deadline=5, confidence=0.99, timeout=3,
+                           retry_delay=0.05, max_retry_delay=1):
+    """
+    Send concurrent keep-alive requests to the HAProxy frontend and record which
+    backend served each one, from the `Serving from` line.
+
+    Stops as soon as every expected host was seen, when no new backend showed up
+    for `misses_before_stop` requests in a row, or at the hard `deadline`. A
+    worker whose request fails waits a jittered delay, doubling from
+    `retry_delay` up to `max_retry_delay`, before it reconnects.
+
+    Returns:
+        dict mapping normalized backend host name to a list of latencies in seconds.
+    """
+    parts = urlsplit(url)
+    expected = set(expected_hosts or [])
+    latencies = {}
+    state = {"misses": 0}
+    lock = threading.Lock()
+    done = threading.Event()
+    stop_at = time.monotonic() + deadline
+
+    def record(host, latency):
+        with lock:
+            if host in latencies:
+                state["misses"] += 1
+            else:
+                latencies[host] = []
+                state["misses"] = 0
+            latencies[host].append(latency)
+            if expected and expected <= latencies.keys():
+                done.set()
+            elif state["misses"] >= misses_before_stop(len(latencies), confidence):
+                done.set()
+
+    def worker():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        delay = retry_delay
+        try:
+            while not done.is_set() and time.monotonic() < stop_at:
+                started = time.monotonic()
+                try:
+                    conn.request("GET", parts.path or "/")
+                    response = conn.getresponse()
+                    body = response.read().decode(errors="replace")
+                except (OSError, http.client.HTTPException):
+                    # Drop the broken connection and back off before the next
+                    # request reconnects, so a refusing HAProxy is not flooded.
+                    conn.close()
+                    done.wait(min(random.uniform(0, delay), max(0, stop_at - time.monotonic())))
+                    delay = min(delay * 2, max_retry_delay)
+                    continue
+                delay = retry_delay
+                match = SERVING_PATTERN.search(body)
+                if match:
+                    record(normalize_host(match.group(1)), time.monotonic() - started)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return latencies
+
 def check_reachability_via_haproxy(haproxy_ip, haproxy_port, inventory_file, group_name="webservers"):
     # Helper to parse inventory and get hosts of the group
     def get_expected_hosts(inventory_file, group_name):
@@ -16,37 +106,18 @@ def check_reachability_via_haproxy(haproxy_ip, haproxy_port, inventory_file, gro
             raise ValueError(f"Group '{group_name}' not found in inventory")
         return list(config[group_name].keys())
 
-    # Curl HAProxy and detect reachable hosts via round-robin repeat detection
-    def get_reachable_hosts_via_roundrobin(url):
-        seen_hosts = []
-        pattern = re.compile(r"Serving from (\S+)")
-        # print(f"Starting to curl HAProxy at {url}...")
-        while True:
-            try:
-                result = subprocess.run(
-                    ["curl", "-s", url],
-                    capture_output=True,
-                    text=True,
-                    timeout=3
-                )
-                match = pattern.search(result.stdout)
-                
-                if match:
-                    host = match.group(1) 
-                    if host in seen_hosts:
-                        break
-                    seen_hosts.append(host)
-                else:
-                    pass
-            except subprocess.TimeoutExpired:
-                pass
-            time.sleep(0.5)
-        return set(seen_hosts)
+    # Detect reachable hosts from the backends that answer through HAProxy
+    def get_reachable_hosts_via_roundrobin(url, expected_hosts):
+        latencies = probe_haproxy_backends(url, expected_hosts)
+        for host, samples in sorted(latencies.items()):
+            logging.info("Backend %s served %d requests, median latency %.1f ms.",
+                         host, len(samples), 1000 * sorted(samples)[len(samples) // 2])
+        return set(latencies)
 
     url = f"http://{haproxy_ip}:{haproxy_port}"
 
     expected_hosts = set(normalize_host(h) for h in get_expected_hosts(inventory_file, group_name))
-    reachable_hosts = set(normalize_host(h) for h in get_reachable_hosts_via_roundrobin(url))
+    reachable_hosts = get_reachable_hosts_via_roundrobin(url, expected_hosts)
 
     unreachable_hosts = set(expected_hosts) - reachable_hosts
 
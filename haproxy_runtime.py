@@ -0,0 +1,270 @@
+import re
+import csv
+import time
+import shlex
+import logging
+import subprocess
+
+from metrics import instrument
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+HAPROXY_SOCKET = "/run/haproxy/admin.sock"
+HAPROXY_BACKEND = "http_back"
+WEBSERVER_PORT = 5000
+# Address of the disabled server slots haproxy.cfg.j2 reserves for future
+# webservers.
+FREE_SLOT_ADDR = "127.0.0.1"
+
+_END_MARKER = "__haproxy_command_end__"
+
+
+@instrument("ssh.haproxy_runtime")
+def run_haproxy_commands(config_path, haproxy_host, commands, timeout=15):
+    """
+    Run admin socket commands on the HAProxy host over a single SSH session.
+
+    Every command is followed by a marker carrying the exit status of its
+    socat, so a missing socat, a wrong socket or a sudo failure is not
+    mistaken for HAProxy's empty answer to a successful command.
+
+    Returns:
+        list of command outputs, in the order of `commands`.
+
+    Raises:
+        RuntimeError: when ssh fails or any command did not reach HAProxy.
+    """
+    script = "; ".join(
+        f"echo {shlex.quote(command)} | sudo socat stdio {HAPROXY_SOCKET}; echo {_END_MARKER} $?"
+        for command in commands
+    )
+    result = subprocess.run(
+        ["ssh", "-F", config_path, haproxy_host, script],
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ssh to {haproxy_host} failed: {result.stderr.strip()}")
+    parts = re.split(rf"{_END_MARKER} (\d+)\n", result.stdout)
+    outputs = [output.strip() for output in parts[0:-1:2]]
+    statuses = [int(status) for status in parts[1::2]]
+    if len(statuses) < len(commands):
+        raise RuntimeError(f"HAProxy on {haproxy_host} answered {len(statuses)} of {len(commands)} commands: "
+                           f"{result.stderr.strip()}")
+    failed = [command for command, status in zip(commands, statuses) if status != 0]
+    if failed:
+        raise RuntimeError(f"HAProxy commands failed on {haproxy_host} ({', '.join(failed)}): "
+                           f"{result.stderr.strip()}")
+    return outputs[:len(commands)]
+
+
+def show_backend_servers(config_path, haproxy_host, backend=HAPROXY_BACKEND):
+    """
+    Read the servers of a backend from `show servers state`.
+
+    Returns:
+        dict server name -> {"addr": ..., "op_state": ..., "admin_state": ...}
+    """
+    output = run_haproxy_commands(config_path, haproxy_host, [f"show servers state {backend}"])[0]
+    servers = {}
+    columns = None
+    for line in output.splitlines():
+        if line.startswith("#"):
+            columns = line.lstrip("# ").split()
+            continue
+        fields = line.split()
+        if columns is None or len(fields) < len(columns):
+            continue
+        row = dict(zip(columns, fields))
+        servers[row["srv_name"]] = {
+            "addr": row["srv_addr"],
+            "op_state": int(row["srv_op_state"]),
+            "admin_state": int(row["srv_admin_state"]),
+        }
+    return servers
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def read_backend_stats(config_path, haproxy_host, backend=HAPROXY_BACKEND):
+    """
+    Read live load for a backend from `show stat` on the admin socket.
+
+    Returns:
+        dict with the backend's "sessions", "queue" and "response_ms", and
+        "servers": server name -> {"sessions", "queue", "response_ms", "status"}.
+    """
+    output = run_haproxy_commands(config_path, haproxy_host, ["show stat"])[0]
+    lines = output.splitlines()
+    if not lines or not lines[0].startswith("# "):
+        raise RuntimeError(f"Unexpected 'show stat' output: {output[:200]}")
+    lines[0] = lines[0][2:]
+    stats = {"sessions": 0, "queue": 0, "response_ms": 0, "servers": {}}
+    for row in csv.DictReader(lines):
+        if row["pxname"] != backend:
+            continue
+        entry = {
+            "sessions": _to_int(row["scur"]),
+            "queue": _to_int(row["qcur"]),
+            "response_ms": _to_int(row["rtime"]),
+            "status": row["status"],
+        }
+        if row["svname"] == "BACKEND":
+            stats.update({key: entry[key] for key in ("sessions", "queue", "response_ms")})
+        elif row["svname"] != "FRONTEND":
+            stats["servers"][row["svname"]] = entry
+    return stats
+
+
+def serving_slots(servers):
+    """
+    The servers of a `show_backend_servers` result that hold a webserver,
+    leaving out the free slots.
+    """
+    return {name: server for name, server in servers.items() if server["addr"] != FREE_SLOT_ADDR}
+
+
+def plan_backend_changes(current, desired, backend=HAPROXY_BACKEND, port=WEBSERVER_PORT):
+    """
+    Build the runtime commands that turn the `current` backend into `desired`.
+
+    Only commands HAProxy 2.0 knows are used: a new webserver takes over its
+    free slot with `set server addr` and `state ready`, a removed one goes
+    to MAINT and gives its slot back. Every name in `desired` must have a
+    slot in `current`.
+
+    Each entry is (command, expected) where `expected` is a substring of a
+    successful answer, or None when HAProxy answers with nothing on success.
+    """
+    commands = []
+    for name, ip in sorted(desired.items()):
+        server = f"{backend}/{name}"
+        if current[name]["addr"] == FREE_SLOT_ADDR:
+            commands += [
+                (f"set server {server} addr {ip} port {port}", "change"),
+                (f"set server {server} state ready", None),
+            ]
+        elif current[name]["addr"] != ip:
+            commands.append((f"set server {server} addr {ip} port {port}", "change"))
+    for name in sorted(set(serving_slots(current)) - set(desired)):
+        server = f"{backend}/{name}"
+        commands += [
+            (f"set server {server} state maint", None),
+            (f"shutdown sessions server {server}", None),
+            (f"set server {server} addr {FREE_SLOT_ADDR} port {port}", "change"),
+        ]
+    return commands
+
+
+def sync_backend(config_path, haproxy_host, desired, backend=HAPROXY_BACKEND):
+    """
+    Apply adds, removes and address changes to the running backend in place.
+
+    Args:
+        desired (dict): webserver name -> fixed IP that should be in rotation.
+
+    Returns:
+        True if the running backend now matches `desired`, False if the
+        runtime API could not do it (e.g. no free slot is left for a new
+        webserver) and the caller should fall back to a full configuration
+        render.
+    """
+    try:
+        current = show_backend_servers(config_path, haproxy_host, backend)
+        unslotted = sorted(set(desired) - set(current))
+        if unslotted:
+            logging.info("No HAProxy server slot for %s, the configuration has to be reloaded.",
+                         ", ".join(unslotted))
+            return False
+        commands = plan_backend_changes(current, desired, backend)
+        if not commands:
+            logging.info("HAProxy backend %s already up to date.", backend)
+            return True
+        outputs = run_haproxy_commands(config_path, haproxy_host, [command for command, _ in commands])
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logging.error("HAProxy runtime API unavailable: %s", e)
+        return False
+
+    ok = True
+    for (command, expected), output in zip(commands, outputs):
+        if (expected is None and output) or (expected is not None and expected not in output):
+            logging.error("HAProxy command '%s' failed: %s", command, output or "no answer")
+            ok = False
+        else:
+            logging.info("HAProxy: %s", command)
+    return ok
+
+
+def set_servers_state(config_path, haproxy_host, names, state, backend=HAPROXY_BACKEND):
+    """
+    Set the admin state ("ready", "drain" or "maint") of several servers at once.
+
+    Returns:
+        True if HAProxy accepted every command.
+    """
+    if not names:
+        return True
+    commands = [f"set server {backend}/{name} state {state}" for name in names]
+    try:
+        outputs = run_haproxy_commands(config_path, haproxy_host, commands)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        logging.error("Could not set %s to %s: %s", ", ".join(names), state, e)
+        return False
+    ok = True
+    for command, output in zip(commands, outputs):
+        if output:
+            logging.error("HAProxy command '%s' failed: %s", command, output)
+            ok = False
+        else:
+            logging.info("HAProxy: %s", command)
+    return ok
+
+
+def drain_servers(config_path, haproxy_host, names, backend=HAPROXY_BACKEND):
+    """
+    Put servers in DRAIN: they get no new connections but keep serving the
+    ones they have.
+    """
+    return set_servers_state(config_path, haproxy_host, names, "drain", backend)
+
+
+def disable_servers(config_path, haproxy_host, names, backend=HAPROXY_BACKEND):
+    """
+    Put servers in MAINT: HAProxy stops sending them traffic at once.
+    """
+    return set_servers_state(config_path, haproxy_host, names, "maint", backend)
+
+
+def wait_for_drain(config_path, haproxy_host, names, timeout=30, interval=1, backend=HAPROXY_BACKEND):
+    """
+    Wait until the servers have no active sessions left, or `timeout` seconds.
+
+    Returns:
+        True if every server drained in time.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            servers = read_backend_stats(config_path, haproxy_host, backend)["servers"]
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            logging.error("Could not read HAProxy stats while draining: %s", e)
+            return False
+        active = {name: servers[name]["sessions"] for name in names if servers.get(name, {}).get("sessions")}
+        if not active:
+            return True
+        if time.monotonic() >= deadline:
+            logging.warning("Drain deadline reached with sessions still open: %s", active)
+            return False
+        time.sleep(interval)
@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import atexit
+import socket
+import asyncio
+import logging
+import struct
+import threading
+import subprocess
+from configparser import ConfigParser
+
+from metrics import instrument
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+_tunnels = {}
+_tunnels_lock = threading.Lock()
+
+
+def read_inventory_groups(inventory_path):
+    """
+    Parse the Ansible hosts file into a dict of group name -> list of hosts.
+    """
+    config = ConfigParser(allow_no_value=True, delimiters=("="))
+    config.optionxform = str
+    config.read(inventory_path)
+    return {
+        group: list(config[group].keys())
+        for group in config.sections()
+        if ":" not in group
+    }
+
+
+def read_ssh_config(config_path):
+    """
+    Parse the generated SSH config into a dict of host alias -> {option: value}.
+    """
+    hosts = {}
+    current = None
+    with open(config_path) as f:
+        for line in f:
+            match = re.match(r"\s*(\S+)\s+(.+?)\s*$", line)
+            if not match:
+                continue
+            key, value = match.groups()
+            if key == "Host":
+                current = hosts.setdefault(value, {})
+            elif current is not None:
+                current[key] = value
+    return hosts
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BastionTunnel:
+    """
+    One SSH connection to the bastion exposing a local SOCKS5 proxy (`ssh -D`).
+
+    Every probe is a channel multiplexed over this single connection, so
+    checking N hosts costs N channel opens instead of N SSH handshakes.
+    """
+
+    def __init__(self, config_path, bastion, connect_timeout=15):
+        self.config_path = config_path
+        self.bastion = bastion
+        self.connect_timeout = connect_timeout
+        self.port = None
+        self.proc = None
+        self._lock = threading.RLock()
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def ensure(self):
+        """
+        Start the tunnel if it is not running. Returns True when it is usable.
+        """
+        # The refill and reconcile threads probe at the same time.
+        with self._lock:
+            if self.is_alive():
+                return True
+            self.port = _free_port()
+            cmd = [
+                "ssh", "-F", self.config_path, "-N",
+                "-D", f"127.0.0.1:{self.port}",
+                "-o", "ExitOnForwardFailure=yes",
+                "-o", "ServerAliveInterval=15",
+                "-o", f"ConnectTimeout={self.connect_timeout}",
+                self.bastion,
+            ]
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            deadline = time.monotonic() + self.connect_timeout
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    logging.error("Tunnel to %s failed: %s", self.bastion, self.proc.stderr.read().strip())
+                    return False
+                try:
+                    socket.create_connection(("127.0.0.1", self.port), timeout=0.2).close()
+                    logging.info("Tunnel to %s listening on port %d.", self.bastion, self.port)
+                    return True
+                except OSError:
+                    time.sleep(0.1)
+            logging.error("Tunnel to %s did not come up within %d seconds.", self.bastion, self.connect_timeout)
+            self.close()
+            return False
+
+    def close(self):
+        with self._lock:
+            if self.is_alive():
+                self.proc.terminate()
+                try:
+                    self.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.proc.kill()
+            self.proc = None
+
+
+def get_tunnel(config_path, bastion):
+    """
+    Return the shared tunnel for a bastion, reused across probe rounds.
+    """
+    key = (os.path.abspath(config_path), bastion)
+    with _tunnels_lock:
+        if key not in _tunnels:
+            _tunnels[key] = BastionTunnel(config_path, bastion)
+        return _tunnels[key]
+
+
+@atexit.register
+def close_tunnels():
+    with _tunnels_lock:
+        tunnels = list(_tunnels.values())
+    for tunnel in tunnels:
+        tunnel.close()
+
+
+async def _socks_open(proxy_port, host, port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", proxy_port)
+    writer.write(b"\x05\x01\x00")
+    await writer.drain()
+    if await reader.readexactly(2) != b"\x05\x00":
+        raise ConnectionError("SOCKS proxy refused the handshake")
+    address = host.encode()
+    writer.write(b"\x05\x01\x00\x03" + bytes([len(address)]) + address + struct.pack(">H", port))
+    await writer.drain()
+    reply = await reader.readexactly(4)
+    if reply[1] != 0:
+        raise ConnectionError(f"SOCKS connect to {host}:{port} failed with code {reply[1]}")
+    # Skip the bound address returned by the proxy.
+    if reply[3] == 1:
+        await reader.readexactly(4 + 2)
+    elif reply[3] == 3:
+        await reader.readexactly((await reader.readexactly(1))[0] + 2)
+    else:
+        await reader.readexactly(16 + 2)
+    return reader, writer
+
+
+async def _probe(proxy_port, ip, port, http):
+    reader, writer = await _socks_open(proxy_port, ip, port)
+    try:
+        if http:
+            writer.write(f"GET / HTTP/1.0\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status = await reader.readline()
+            return re.match(rb"HTTP/1\.[01] 200", status) is not None
+        # OpenSSH acknowledges SOCKS connects before the remote side answers,
+        # so wait for the SSH banner to know the port is really open.
+        return (await reader.readline()).startswith(b"SSH-")
+    finally:
+        writer.close()
+
+
+async def _probe_with_timeout(proxy_port, ip, port, http, timeout):
+    try:
+        return await asyncio.wait_for(_probe(proxy_port, ip, port, http), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return False
+
+
+async def probe_targets(proxy_port, targets, port=5000, http=True, timeout=3):
+    """
+    Probe every (host, ip) pair concurrently. Returns a dict host -> bool.
+    """
+    hosts = list(targets)
+    results = await asyncio.gather(*(
+        _probe_with_timeout(proxy_port, targets[host], port, http, timeout)
+        for host in hosts
+    ))
+    return dict(zip(hosts, results))
+
+
+@instrument("ssh.probe")
+def probe_addresses(config_path, bastion, targets, port=5000, http=True, timeout=3):
+    """
+    Probe a dict of host -> IP through the tunnel to `bastion`, for hosts
+    that may not be in the inventory yet.
+
+    Returns:
+        dict host -> bool; every host is False when the tunnel is down.
+    """
+    tunnel = get_tunnel(config_path, bastion)
+    if not targets or not tunnel.ensure():
+        return dict.fromkeys(targets, False)
+    return asyncio.run(probe_targets(tunnel.port, targets, port=port, http=http, timeout=timeout))
+
+
+@instrument("ssh.probe")
+def probe_hosts(inventory_path, config_path, hosts="webservers", port=5000, http=True, timeout=3):
+    """
+    Check the hosts of an inventory group through one tunnel to the bastion.
+
+    By default this is an application check: an HTTP GET on the Flask port.
+    With http=False it checks that the SSH daemon answers on `port` instead.
+
+    Returns:
+        (unreachable_hosts, reachable_hosts) lists, like the Ansible ping parser.
+    """
+    groups = read_inventory_groups(inventory_path)
+    ssh_hosts = read_ssh_config(config_path)
+    bastion = (groups.get("Bastion") or [None])[0]
+    if hosts == "all":
+        names = [name for group in groups.values() for name in group]
+    else:
+        names = list(groups.get(hosts, []))
+
+    tunnel = get_tunnel(config_path, bastion) if bastion else None
+    if tunnel is None or not tunnel.ensure():
+        return names, []
+
+    targets = {
+        name: ssh_hosts.get(name, {}).get("HostName", name)
+        for name in names
+        if name != bastion
+    }
+    results = asyncio.run(probe_targets(tunnel.port, targets, port=port, http=http, timeout=timeout))
+    # The bastion itself is reachable when the tunnel through it is up.
+    if bastion in names:
+        results[bastion] = True
+
+    unreachable_hosts = [name for name in names if not results.get(name)]
+    reachable_hosts = [name for name in names if results.get(name)]
+    return unreachable_hosts, reachable_hosts
@@ -0,0 +1,233 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from remove_infra import run_dependency_graph
+from security_groups import (
+    SECURITY_GROUPS,
+    desired_rules,
+    diff_security_group_rules,
+    sync_security_group_rules
+)
+from variables import EXTERNAL_NETWORK_NAME
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+CIDR = "192.168.0.0/24"
+GATEWAY_IP = "192.168.0.1"
+
+
+def _by_name(resources, name):
+    return next((resource for resource in resources if resource.name == name), None)
+
+
+def fetch_state(conn, tag):
+    """
+    Read everything the base infrastructure of a tag consists of with a
+    handful of list calls issued in parallel.
+
+    Returns:
+        dict with "keypair", "network", "external_network", "subnet",
+        "router", "router_interface" (bool), "security_groups"
+        (role -> group or None) and "rules" (group id -> ingress rules).
+    """
+    listings = {
+        "keypairs": lambda: list(conn.compute.keypairs()),
+        "networks": lambda: list(conn.network.networks()),
+        "subnets": lambda: list(conn.network.subnets(name=f"{tag}subnet")),
+        "routers": lambda: list(conn.network.routers(name=f"{tag}router")),
+        "security_groups": lambda: list(conn.network.security_groups()),
+        "rules": lambda: list(conn.network.security_group_rules(direction="ingress")),
+    }
+    with ThreadPoolExecutor(max_workers=len(listings)) as executor:
+        futures = {name: executor.submit(listing) for name, listing in listings.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    state = {
+        "keypair": _by_name(results["keypairs"], f"{tag}keypair"),
+        "network": _by_name(results["networks"], f"{tag}network"),
+        "external_network": _by_name(results["networks"], EXTERNAL_NETWORK_NAME),
+        "subnet": _by_name(results["subnets"], f"{tag}subnet"),
+        "router": _by_name(results["routers"], f"{tag}router"),
+        "router_interface": False,
+        "security_groups": {
+            role: _by_name(results["security_groups"], f"{tag}-{role}-sg")
+            for role in SECURITY_GROUPS
+        },
+        "rules": {},
+    }
+    for rule in results["rules"]:
+        state["rules"].setdefault(rule.security_group_id, []).append(rule)
+    if state["router"] and state["subnet"]:
+        state["router_interface"] = any(
+            fixed_ip.get("subnet_id") == state["subnet"].id
+            for port in conn.network.ports(device_id=state["router"].id, device_owner="network:router_interface")
+            for fixed_ip in port.fixed_ips or []
+        )
+    return state
+
+
+def plan(tag, state):
+    """
+    List the steps needed to bring the base infrastructure from `state` to
+    the declared one, in no particular order. An up-to-date tag plans nothing.
+    """
+    steps = []
+    if not state["keypair"]:
+        steps.append("keypair")
+    if not state["network"]:
+        steps.append("network")
+    if not state["subnet"]:
+        steps.append("subnet")
+    if not state["router"]:
+        steps.append("router")
+    router = state["router"]
+    if state["external_network"] and not (router and router.external_gateway_info):
+        steps.append("router_gateway")
+    if not state["router_interface"]:
+        steps.append("router_interface")
+
+    groups = state["security_groups"]
+    missing_groups = [role for role, sg in groups.items() if not sg]
+    steps.extend(f"security_group:{role}" for role in missing_groups)
+    for role, sg in groups.items():
+        if missing_groups:
+            # Remote groups are about to change; resolve every rule set again.
+            steps.append(f"rules:{role}")
+            continue
+        by_name = {group.name: group for group in groups.values()}
+        missing, stale = diff_security_group_rules(
+            state["rules"].get(sg.id, []),
+            desired_rules(tag, role, None, groups=by_name)
+        )
+        if missing or stale:
+            steps.append(f"rules:{role}")
+    return steps
+
+
+def apply(conn, tag, public_key_path, state, steps, max_workers=6):
+    """
+    Carry out the planned steps. Independent branches (keypair, network
+    chain, security groups) run in parallel; every step waits only for the
+    resources it needs.
+
+    Returns:
+        (resources, failed_steps) where resources holds "keypair", "network",
+        "subnet", "router" and "security_groups" (role -> group).
+    """
+    resources = {
+        "keypair": state["keypair"],
+        "network": state["network"],
+        "subnet": state["subnet"],
+        "router": state["router"],
+        "security_groups": dict(state["security_groups"]),
+    }
+
+    def create_keypair():
+        with open(public_key_path, 'r') as pubkey_file:
+            public_key = pubkey_file.read().strip()
+        resources["keypair"] = conn.compute.create_keypair(name=f"{tag}keypair", public_key=public_key)
+        logging.info(f"Keypair '{tag}keypair' created.")
+
+    def create_network():
+        resources["network"] = conn.network.create_network(name=f"{tag}network")
+        logging.info(f"Network '{tag}network' created.")
+
+    def create_subnet():
+        resources["subnet"] = conn.network.create_subnet(
+            name=f"{tag}subnet",
+            network_id=resources["network"].id,
+            ip_version=4,
+            cidr=CIDR,
+            gateway_ip=GATEWAY_IP,
+            dns_nameservers=["8.8.8.8"]
+        )
+        logging.info(f"Subnet '{tag}subnet' created.")
+
+    def create_router():
+        resources["router"] = conn.network.create_router(name=f"{tag}router")
+        logging.info(f"Router '{tag}router' created.")
+
+    def set_router_gateway():
+        resources["router"] = conn.network.update_router(
+            resources["router"],
+            external_gateway_info={"network_id": state["external_network"].id}
+        )
+        logging.info(f"Router '{tag}router' connected to external network '{EXTERNAL_NETWORK_NAME}'.")
+
+    def add_router_interface():
+        conn.network.add_interface_to_router(resources["router"], subnet_id=resources["subnet"].id)
+        logging.info(f"Router '{tag}router' interface added to subnet '{tag}subnet'.")
+
+    def create_group(role):
+        def step():
+            resources["security_groups"][role] = conn.network.create_security_group(
+                name=f"{tag}-{role}-sg",
+                description=SECURITY_GROUPS[role]["description"]
+            )
+            logging.info(f"Created security group '{tag}-{role}-sg'.")
+        return step
+
+    def sync_rules(role):
+        def step():
+            sg = resources["security_groups"][role]
+            by_name = {group.name: group for group in resources["security_groups"].values() if group}
+            sync_security_group_rules(
+                conn,
+                sg,
+                desired_rules(tag, role, conn, groups=by_name),
+                live_rules=state["rules"].get(sg.id, [])
+            )
+        return step
+
+    group_steps = [f"security_group:{role}" for role in SECURITY_GROUPS]
+    graph = {
+        "keypair": (create_keypair, []),
+        "network": (create_network, []),
+        "subnet": (create_subnet, ["network"]),
+        "router": (create_router, []),
+        "router_gateway": (set_router_gateway, ["router"]),
+        "router_interface": (add_router_interface, ["router", "subnet"]),
+    }
+    for role in SECURITY_GROUPS:
+        graph[f"security_group:{role}"] = (create_group(role), [])
+        graph[f"rules:{role}"] = (sync_rules(role), group_steps)
+
+    selected = {
+        name: (step, [dep for dep in deps if dep in steps])
+        for name, (step, deps) in graph.items()
+        if name in steps
+    }
+    failed = run_dependency_graph(selected, max_workers=max_workers) if selected else []
+    return resources, failed
+
+
+def ensure_base_infrastructure(conn, tag, public_key_path):
+    """
+    Make sure the keypair, network, subnet, router and security groups of a
+    tag exist and are configured, creating only what is missing.
+
+    Returns:
+        (keypair, network, subnet, router, security_groups) with
+        security_groups mapping role ("bastion", "haproxy", "webservers")
+        to the group.
+    """
+    state = fetch_state(conn, tag)
+    steps = plan(tag, state)
+    if steps:
+        logging.info(f"Base infrastructure plan for '{tag}': {', '.join(steps)}.")
+    else:
+        logging.info(f"Base infrastructure for '{tag}' is up to date.")
+    resources, failed = apply(conn, tag, public_key_path, state, steps)
+    if failed:
+        raise RuntimeError(f"Base infrastructure steps failed for '{tag}': {', '.join(failed)}")
+    return (
+        resources["keypair"],
+        resources["network"],
+        resources["subnet"],
+        resources["router"],
+        resources["security_groups"],
+    )
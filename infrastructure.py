@@ -1,6 +1,12 @@
 import subprocess
 import os
+import re
+import json
+import shlex
+import atexit
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 from variables import (
@@ -14,19 +20,131 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+AUTH_CACHE_DIR = os.path.expanduser("~/.cache/openstack_project")
+
+_OPENRC_LINE = re.compile(r"^(?:export\s+)?(OS_\w+)=(.*)$")
+_OPENRC_UNSET = re.compile(r"^unset\s+((?:OS_\w+\s*)+)$")
+
+def parse_openrc(openrc_path):
+    """
+    Read the OS_* variables of an openrc file without a shell.
+
+    Only plain assignments (`export OS_X=value`, quoted or not) and
+    `unset OS_X` are understood. Returns (variables, unset_names), or None
+    when the file does anything else (prompts, substitutions, conditionals).
+    """
+    variables = {}
+    unset = []
+    with open(openrc_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            match = _OPENRC_UNSET.match(line)
+            if match:
+                for key in match.group(1).split():
+                    # Later lines win, as they would in a shell.
+                    variables.pop(key, None)
+                    if key not in unset:
+                        unset.append(key)
+                continue
+            match = _OPENRC_LINE.match(line)
+            if not match:
+                return None
+            key, raw = match.groups()
+            # Single quotes are literal; anything else must not expand.
+            if "`" in raw or ("$" in raw and not (raw.startswith("'") and raw.endswith("'"))):
+                return None
+            try:
+                values = shlex.split(raw, comments=True)
+            except ValueError:
+                return None
+            if len(values) > 1:
+                return None
+            variables[key] = values[0] if values else ""
+            if key in unset:
+                unset.remove(key)
+    return variables, unset
+
 def load_openrc(openrc_path):
     """
     Load environment variables from an OpenStack openrc file into the Python environment.
+
+    Simple files are parsed directly; anything else (e.g. the password prompt
+    of the Horizon openrc) is sourced by bash and only its OS_* variables are
+    copied.
     """
-    command = ['bash', '-c', f"source {openrc_path} && env"]
+    parsed = parse_openrc(openrc_path)
+    if parsed is not None:
+        variables, unset = parsed
+        for key in unset:
+            os.environ.pop(key, None)
+        os.environ.update(variables)
+        return
+
+    command = ['bash', '-c', f"source {shlex.quote(openrc_path)} && env -0"]
     proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
-    
-    for line in proc.stdout:
-        key, _, value = line.partition("=")
-        os.environ[key.strip()] = value.strip()
+    output, _ = proc.communicate()
+    sourced = {}
+    for entry in output.split("\0"):
+        key, _, value = entry.partition("=")
+        if key.startswith("OS_"):
+            sourced[key] = value
+    # The file may unset variables inherited from our environment.
+    for key in [key for key in os.environ if key.startswith("OS_") and key not in sourced]:
+        del os.environ[key]
+    os.environ.update(sourced)
+
+def _auth_cache_file():
+    identity = json.dumps({key: value for key, value in sorted(os.environ.items()) if key.startswith("OS_")
+                           and key not in ("OS_PASSWORD", "OS_APPLICATION_CREDENTIAL_SECRET")})
+    return os.path.join(AUTH_CACHE_DIR, f"auth-{hashlib.sha256(identity.encode()).hexdigest()[:16]}.json")
+
+def _save_auth_state(auth, path, loaded_state):
+    try:
+        state = auth.get_auth_state()
+    except Exception as e:
+        logging.debug(f"Could not read the auth state: {e}")
+        return
+    if not state or state == loaded_state:
+        return
+    os.makedirs(AUTH_CACHE_DIR, mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(state)
+    os.replace(tmp_path, path)
+
+def connect(cache_auth=True):
+    """
+    Connect to OpenStack from the OS_* environment.
+
+    With `cache_auth`, the Keystone token and service catalog of the last
+    run are restored from a 0600 file under AUTH_CACHE_DIR, so no
+    authentication round trip is made while the token is valid; keystoneauth
+    re-authenticates on its own once it is about to expire. The current
+    state is written back when the process exits.
+    """
+    import openstack
+
+    conn = openstack.connect()
+    auth = conn.session.auth
+    if not cache_auth or not hasattr(auth, "set_auth_state"):
+        return conn
+    path = _auth_cache_file()
+    loaded_state = None
+    try:
+        with open(path) as f:
+            loaded_state = f.read()
+        auth.set_auth_state(loaded_state)
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Ignoring unreadable auth cache {path}: {e}")
+        loaded_state = None
+    atexit.register(_save_auth_state, auth, path, loaded_state)
+    return conn
 
-    proc.communicate()
-    
 
 def create_or_get_keypair(tag, public_key_path, conn, log=True):
     key_name = f"{tag}keypair"
@@ -111,6 +229,39 @@ def create_or_get_network(tag, conn, log=True):
 
     return network, subnet, router
 
+def find_image_and_flavor(conn, image_name_or_id=IMAGE_NAME):
+    """
+    Resolve the image and flavor used for every server of the deployment.
+    """
+    image = conn.compute.find_image(name_or_id=image_name_or_id)
+    flavor = conn.compute.find_flavor(name_or_id=FLAVOR_NAME)
+    if not image or not flavor:
+        raise ValueError(
+            f"{'' if image else 'Image ' + image_name_or_id + ' not found. '}"
+            f"{'' if flavor else 'Flavor ' + FLAVOR_NAME + ' not found. '}"
+        )
+    return image, flavor
+
+def baked_image_file(tag):
+    """
+    Path of the file recording the baked webserver image ID for a tag.
+    """
+    return abs_path(f"./{tag}_image")
+
+def load_baked_image_id(tag):
+    """
+    Return the baked webserver image ID for a tag, or None if none was baked.
+    """
+    try:
+        with open(baked_image_file(tag)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def save_baked_image_id(tag, image_id):
+    with open(baked_image_file(tag), "w") as f:
+        f.write(image_id + "\n")
+
 def create_or_get_server(conn, name, tag, network, key_name, security_groups, user_data=None):
     """
     Create a virtual server in OpenStack.
@@ -125,13 +276,7 @@ def create_or_get_server(conn, name, tag, network, key_name, security_groups, us
         user_data = ""
     sec_groups = [{"name": security_groups.name}]
     # Create the server
-    image = conn.compute.find_image(name_or_id=IMAGE_NAME)
-    flavor = conn.compute.find_flavor(name_or_id=FLAVOR_NAME)
-    if not image or not flavor:
-        raise ValueError(
-            f"{'Image ' + IMAGE_NAME + ' not found. '}"
-            f"{'Flavor ' + FLAVOR_NAME + ' not found. '}"
-        )
+    image, flavor = find_image_and_flavor(conn)
     server = conn.compute.create_server(
         name=name,
         image_id=image.id,
@@ -147,6 +292,118 @@ def create_or_get_server(conn, name, tag, network, key_name, security_groups, us
     logging.info(f"Server '{name}' created.")
     return server
 
+def create_servers(conn, names, tag, network, key_name, security_groups, user_data=None, max_workers=10, cache=None,
+                   image_name_or_id=IMAGE_NAME, metadata=None):
+    """
+    Create several servers at once and wait for all of them to become ACTIVE.
+
+    Image and flavor are resolved once, every create request is submitted up
+    front and the waits run together on a bounded worker pool, so a batch
+    costs roughly one boot time instead of one per server.
+
+    Args:
+        conn (openstack.connection.Connection): Authenticated OpenStack connection.
+        names (list): Names of the servers to create.
+        max_workers (int): Upper bound on concurrent waits.
+        cache (ResourceCache): Optional cache used to look up existing servers.
+        image_name_or_id (str): Image to boot from, e.g. a baked webserver image.
+        metadata (dict): Optional server metadata set at boot.
+
+    Returns:
+        (servers, failures): dicts mapping server name to the ACTIVE server
+        and server name to the exception that stopped it.
+    """
+    servers = {}
+    failures = {}
+    if not names:
+        return servers, failures
+
+    listing = cache.servers() if cache else conn.compute.servers(name=f"^{tag}_")
+    existing = {server.name: server for server in listing}
+    image, flavor = find_image_and_flavor(conn, image_name_or_id)
+    sec_groups = [{"name": security_groups.name}]
+
+    pending = {}
+    for name in names:
+        if name in existing:
+            logging.info(f"Server '{name}' already exists.")
+            pending[name] = existing[name]
+            continue
+        try:
+            pending[name] = conn.compute.create_server(
+                name=name,
+                image_id=image.id,
+                flavor_id=flavor.id,
+                networks=[{"uuid": network.id}],
+                key_name=key_name.id,
+                security_groups=sec_groups,
+                user_data=user_data or "",
+                metadata=metadata or {}
+            )
+            logging.info(f"Server '{name}' requested.")
+        except Exception as e:
+            logging.error(f"Error requesting server '{name}': {e}")
+            failures[name] = e
+
+    if not pending:
+        return servers, failures
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+        futures = {
+            executor.submit(conn.compute.wait_for_server, server): name
+            for name, server in pending.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                servers[name] = future.result()
+                logging.info(f"Server '{name}' is ACTIVE.")
+            except Exception as e:
+                logging.error(f"Server '{name}' failed to become ACTIVE: {e}")
+                failures[name] = e
+
+    if cache:
+        cache.invalidate()
+    logging.info(f"Created {len(servers)} of {len(names)} servers, {len(failures)} failed.")
+    return servers, failures
+
+def delete_servers(conn, servers, max_workers=10, cache=None):
+    """
+    Delete several servers at once: every delete request is sent up front and
+    the waits run together, so a batch costs about one deletion time.
+
+    Returns:
+        (deleted, failures): list of deleted server names and a dict of
+        server name -> exception.
+    """
+    deleted = []
+    failures = {}
+    pending = []
+    for server in servers:
+        try:
+            conn.compute.delete_server(server, ignore_missing=True)
+            logging.info(f"Server '{server.name}' deletion requested.")
+            pending.append(server)
+        except Exception as e:
+            logging.error(f"Error deleting server '{server.name}': {e}")
+            failures[server.name] = e
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            futures = {executor.submit(conn.compute.wait_for_delete, server): server.name for server in pending}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                    deleted.append(name)
+                    logging.info(f"Server '{name}' deleted.")
+                except Exception as e:
+                    logging.error(f"Server '{name}' was not deleted: {e}")
+                    failures[name] = e
+
+    if cache:
+        cache.invalidate()
+    return deleted, failures
 
 def assign_or_get_floating_ip(conn, server):
     """
@@ -187,43 +444,49 @@ def abs_path(relative_path):
     """
     return os.path.abspath(os.path.join(os.path.dirname(__file__), relative_path))
 
-def give_server_name_to_create(number_of_servers, reachable_hosts, tag):
+def give_server_name_to_create(number_of_servers, reachable_hosts, tag, exclude=()):
     """
-    Generate server names based on the number of servers and reachable hosts.
+    Generate server names based on the number of servers and reachable hosts,
+    skipping the names in `exclude` (e.g. servers still being deleted).
     """
     server_names = []
-    created_servers = 0
     required_servers = number_of_servers - len(reachable_hosts)
-    for i in range(number_of_servers):
-        server_name = f"{tag}_dev{i+1}"
-        if server_name not in reachable_hosts:
+    i = 0
+    while len(server_names) < required_servers:
+        i += 1
+        server_name = f"{tag}_dev{i}"
+        if server_name not in reachable_hosts and server_name not in exclude:
             server_names.append(server_name)
-            created_servers += 1
-            if created_servers == required_servers:
-                break
     return server_names
 
-def get_floating_ip_for_server(conn, server_name):
+def get_floating_ip_for_server(conn, server_name, cache=None):
     """
     Get the floating IP(s) associated with the given server name.
 
     Args:
         conn (openstack.connection.Connection): Authenticated OpenStack connection.
         server_name (str): Name of the server (e.g., "{tag}_haproxy").
+        cache (ResourceCache): Optional cache to read servers, ports and floating IPs from.
 
     Returns:
         list of floating IP strings or empty list if none found.
     """
     
     # Find the server by name
-    server = conn.compute.find_server(server_name)
+    server = cache.find_server(server_name) if cache else conn.compute.find_server(server_name)
 
     floating_ips = []
     # Get ports attached to the server
-    ports = list(conn.network.ports(device_id=server.id))
+    if cache:
+        ports = cache.ports(device_id=server.id)
+    else:
+        ports = list(conn.network.ports(device_id=server.id))
     for port in ports:
         # For each port, check if there's a floating IP associated
-        fips = list(conn.network.ips(port_id=port.id))
+        if cache:
+            fips = cache.floating_ips(port_id=port.id)
+        else:
+            fips = list(conn.network.ips(port_id=port.id))
         for fip in fips:
             if fip.floating_ip_address:
                 floating_ips.append(fip.floating_ip_address)
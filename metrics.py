@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import types
+import logging
+import functools
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Operation prefix -> name used in the summary line.
+BACKENDS = {"compute": "nova", "network": "neutron", "ssh": "ssh", "ansible": "ansible"}
+
+
+def _new_stat():
+    return {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+
+def _add(stats, name, seconds, error, count=1):
+    stat = stats.setdefault(name, _new_stat())
+    stat["count"] += count
+    stat["errors"] += int(error)
+    stat["seconds"] += seconds
+    stat["max_seconds"] = max(stat["max_seconds"], seconds)
+
+
+class Metrics:
+    """
+    Count, latency and errors per operation (API call, SSH session, Ansible
+    run) and per loop phase, both for the current iteration and since start.
+
+    Phases may nest, e.g. the load balancer refresh that runs from inside the
+    playbook phase; the time of a nested phase is not counted twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.operations = {}
+        self.phases = {}
+        self.iterations = 0
+        self.last_iteration_seconds = 0.0
+        self._iteration_operations = {}
+        self._iteration_phases = {}
+        self._iteration_started = time.perf_counter()
+
+    def record(self, operation, seconds, error=False):
+        with self._lock:
+            _add(self.operations, operation, seconds, error)
+            _add(self._iteration_operations, operation, seconds, error)
+
+    def _record_phase(self, name, seconds, error, count):
+        with self._lock:
+            _add(self.phases, name, seconds, error, count)
+            _add(self._iteration_phases, name, seconds, error, count)
+
+    @contextlib.contextmanager
+    def timed(self, operation):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(operation, time.perf_counter() - started, error)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        stack = getattr(self._local, "phases", None)
+        if stack is None:
+            stack = self._local.phases = []
+        now = time.perf_counter()
+        if stack:
+            # Pause the enclosing phase while this one runs.
+            parent = stack[-1]
+            self._record_phase(parent[0], now - parent[1], False, 0)
+        entry = [name, now]
+        stack.append(entry)
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            self._record_phase(name, now - entry[1], error, 1)
+            if stack:
+                stack[-1][1] = now
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        Make this registry the one instrument() records into for the calling
+        thread, e.g. one registry per deployment in a multi-tag controller.
+        """
+        previous = getattr(_active, "metrics", None)
+        _active.metrics = self
+        try:
+            yield self
+        finally:
+            _active.metrics = previous
+
+    def start_iteration(self):
+        with self._lock:
+            self._iteration_operations = {}
+            self._iteration_phases = {}
+            self._iteration_started = time.perf_counter()
+
+    def end_iteration(self, label=None):
+        """
+        Close the current iteration and log one summary line for it.
+        """
+        with self._lock:
+            self.iterations += 1
+            self.last_iteration_seconds = time.perf_counter() - self._iteration_started
+            operations = dict(self._iteration_operations)
+            phases = dict(self._iteration_phases)
+        label = label or f"Iteration {self.iterations}"
+        summary = self.summarize(label, self.last_iteration_seconds, operations, phases)
+        logging.info(summary)
+        return summary
+
+    @staticmethod
+    def summarize(label, seconds, operations, phases):
+        backends = {}
+        errors = 0
+        for operation, stat in operations.items():
+            backend = BACKENDS.get(operation.split(".")[0], operation.split(".")[0])
+            _add(backends, backend, stat["seconds"], False, stat["count"])
+            errors += stat["errors"]
+        parts = [f"{label} took {seconds:.2f}s"]
+        if phases:
+            parts.append(", ".join(f"{name} {stat['seconds']:.2f}s" for name, stat in phases.items()))
+        if backends:
+            parts.append(", ".join(
+                f"{name} {stat['count']} call{'s' if stat['count'] != 1 else ''} {stat['seconds']:.2f}s"
+                for name, stat in sorted(backends.items())
+            ))
+        parts.append(f"{errors} error{'s' if errors != 1 else ''}")
+        return " | ".join(parts)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "iterations": self.iterations,
+                "last_iteration_seconds": round(self.last_iteration_seconds, 3),
+                "operations": {name: dict(stat) for name, stat in self.operations.items()},
+                "phases": {name: dict(stat) for name, stat in self.phases.items()},
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE deployment_iterations_total counter",
+            f"deployment_iterations_total {snapshot['iterations']}",
+            "# TYPE deployment_last_iteration_seconds gauge",
+            f"deployment_last_iteration_seconds {snapshot['last_iteration_seconds']}",
+        ]
+        for kind in ("operation", "phase"):
+            stats = snapshot[f"{kind}s"]
+            for field, suffix, prom_type in (
+                ("count", "calls_total", "counter"),
+                ("errors", "errors_total", "counter"),
+                ("seconds", "seconds_total", "counter"),
+                ("max_seconds", "max_seconds", "gauge"),
+            ):
+                metric = f"deployment_{kind}_{suffix}"
+                lines.append(f"# TYPE {metric} {prom_type}")
+                for name, stat in sorted(stats.items()):
+                    lines.append(f'{metric}{{{kind}="{name}"}} {round(stat[field], 6)}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to `path`, as JSON when it ends in .json and in the
+        Prometheus text format otherwise. The file is replaced atomically so
+        a scraper never reads half of it.
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.snapshot(), indent=2) + "\n"
+        else:
+            content = self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the metrics on http://host:port/metrics (Prometheus text) and
+        /metrics.json from a background thread.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+        return server
+
+
+# Process-wide registry used by the instrumented helpers.
+METRICS = Metrics()
+
+_active = threading.local()
+
+
+def instrument(operation, metrics=None):
+    """
+    Decorator recording every call of the function as `operation`, into
+    `metrics`, the registry activated for the thread, or METRICS.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with (metrics or getattr(_active, "metrics", None) or METRICS).timed(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _InstrumentedProxy:
+    def __init__(self, proxy, service, metrics):
+        self._proxy = proxy
+        self._service = service
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._proxy, name)
+        if not callable(attr):
+            return attr
+        operation = f"{self._service}.{name}"
+        metrics = self._metrics
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with metrics.timed(operation):
+                result = attr(*args, **kwargs)
+                # List calls return generators that page lazily; drain them so
+                # the request time is counted here and not by the caller.
+                if isinstance(result, types.GeneratorType):
+                    result = list(result)
+                return result
+        return call
+
+
+class InstrumentedConnection:
+    """
+    Wrap an openstack Connection so every compute and network proxy call is
+    recorded in `metrics`. Everything else is passed through.
+    """
+
+    def __init__(self, conn, metrics=None):
+        self._conn = conn
+        metrics = metrics or METRICS
+        self.compute = _InstrumentedProxy(conn.compute, "compute", metrics)
+        self.network = _InstrumentedProxy(conn.network, "network", metrics)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
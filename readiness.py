@@ -0,0 +1,131 @@
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from health_probe import probe_addresses
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Lines cloud-init prints to the console once the first boot is done.
+BOOT_MARKERS = re.compile(r"Cloud-init v\. \S+ finished at|cloud-init.*modules:final.*finished", re.IGNORECASE)
+
+# Port and kind of check behind each network stage.
+NETWORK_STAGES = {
+    "ssh": (22, False),
+    "http": (5000, True),
+}
+
+
+class ReadinessTracker:
+    """
+    Follow freshly booted servers through readiness stages, each host on its
+    own schedule:
+
+    - "boot": cloud-init reported completion on the Nova console log
+    - "ssh": the SSH daemon answers through the bastion
+    - "http": the Flask app returns 200 through the bastion
+
+    A host that fails a check is retried after a delay that doubles up to
+    `max_delay`; a host that passes moves to its next stage right away.
+    Hosts that pass their last stage are handed to `on_ready` in the round
+    they got there, so fast hosts do not wait for slow ones.
+    """
+
+    def __init__(self, conn, config_path, bastion, stages=("boot", "ssh"), initial_delay=1, max_delay=15,
+                 timeout=600, console_lines=50, max_workers=10):
+        self.conn = conn
+        self.config_path = config_path
+        self.bastion = bastion
+        self.stages = stages
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.console_lines = console_lines
+        self.max_workers = max_workers
+
+    def _booted(self, server):
+        try:
+            output = self.conn.compute.get_server_console_output(server, length=self.console_lines)
+        except Exception as e:
+            # Some clouds do not expose the console log; rely on the next stages.
+            logging.debug("No console log for %s (%s), skipping the boot check.", server.name, e)
+            return True
+        return BOOT_MARKERS.search(output.get("output") or "") is not None
+
+    def _check(self, stage, hosts, servers, addresses):
+        """
+        Run one stage check on several hosts at once. Returns host -> bool.
+        """
+        if stage == "boot":
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(hosts))) as executor:
+                return dict(zip(hosts, executor.map(lambda host: self._booted(servers[host]), hosts)))
+        port, http = NETWORK_STAGES[stage]
+        return probe_addresses(
+            self.config_path,
+            self.bastion,
+            {host: addresses[host] for host in hosts},
+            port=port,
+            http=http
+        )
+
+    def wait(self, servers, addresses, on_ready=None):
+        """
+        Track `servers` (name -> server) until each is ready or times out.
+
+        Args:
+            servers (dict): Name -> server as returned by create_servers.
+            addresses (dict): Name -> IP reachable from the bastion.
+            on_ready (callable): Called with the list of hosts that became
+                ready in a round, in the tracking thread.
+
+        Returns:
+            (ready_hosts, failed_hosts) lists.
+        """
+        started = time.monotonic()
+        stage = dict.fromkeys(servers, 0)
+        delay = dict.fromkeys(servers, self.initial_delay)
+        due_at = dict.fromkeys(servers, started)
+        ready, failed = [], []
+
+        while stage:
+            now = time.monotonic()
+            due = [host for host in stage if due_at[host] <= now]
+            if not due:
+                time.sleep(min(due_at[host] for host in stage) - now)
+                continue
+
+            newly_ready = []
+            for index, name in enumerate(self.stages):
+                hosts = [host for host in due if stage[host] == index]
+                if not hosts:
+                    continue
+                for host, passed in self._check(name, hosts, servers, addresses).items():
+                    if passed:
+                        logging.info("%s passed the %s check after %.1f seconds.", host, name,
+                                     time.monotonic() - started)
+                        stage[host] += 1
+                        delay[host] = self.initial_delay
+                        due_at[host] = time.monotonic()
+                        if stage[host] == len(self.stages):
+                            newly_ready.append(host)
+                    else:
+                        due_at[host] = time.monotonic() + delay[host]
+                        delay[host] = min(delay[host] * 2, self.max_delay)
+
+            for host in newly_ready:
+                del stage[host]
+                ready.append(host)
+            for host in [host for host in stage if time.monotonic() - started > self.timeout]:
+                logging.error("%s is still not past the %s check after %d seconds.",
+                              host, self.stages[stage[host]], self.timeout)
+                del stage[host]
+                failed.append(host)
+            if newly_ready and on_ready is not None:
+                on_ready(sorted(newly_ready))
+
+        return ready, failed
@@ -0,0 +1,493 @@
+import time
+import base64
+import logging
+import threading
+import subprocess
+
+from infrastructure import (
+    create_or_get_keypair,
+    create_or_get_network,
+    create_servers,
+    delete_servers,
+    load_baked_image_id,
+    abs_path,
+    give_server_name_to_create,
+    get_floating_ip_for_server
+)
+from resource_cache import ResourceCache
+from security_groups import (
+    create_or_get_webservers_security_group,
+)
+from ansible_helper import (
+    run_ansible_playbook,
+    run_incremental_playbook,
+    check_hosts_status
+)
+from config_hosts_generator import (
+    write_ansible_and_ssh_config,
+    extract_names_ips_from_server,
+    get_webserver_ips,
+    inventory_file,
+    ssh_config_file
+    )
+from haproxy_runtime import (
+    show_backend_servers,
+    serving_slots,
+    sync_backend,
+    read_backend_stats,
+    drain_servers,
+    disable_servers,
+    set_servers_state,
+    wait_for_drain
+)
+from haproxy_curl import probe_haproxy_backends
+from autoscaler import pick_scale_down_victims
+from standby_pool import StandbyPool
+from readiness import ReadinessTracker
+from failure_handler import CircuitBreaker, confirm_failures
+from metrics import METRICS
+from config_renderer import push_lb_configs
+from variables import (
+    IMAGE_NAME,
+    WEBSERVER_USER_DATA,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class Reconciler:
+    """
+    Brings the webservers of one tag to the requested count, one pass at a time.
+
+    `cache` can be a TagView over a tenant-wide cache shared with other tags,
+    `inventory_path` a per-tag inventory, and `metrics` a per-tag registry.
+    Servers removed on scale-down get up to `drain_timeout` seconds to finish
+    their requests. With `standby_size` > 0 a StandbyPool of that many parked
+    webservers serves scale-ups first and takes back removed servers.
+    Servers created or promoted in the last `boot_grace` seconds are not
+    judged dead when they fail a probe.
+
+    With a StateStore as `state`, the base resources and servers recorded by
+    the previous run are verified instead of rediscovered, and every config
+    write and probe round is recorded for the next one.
+    """
+
+    def __init__(self, conn, tag, public_key_path, cache=None, inventory_path=None, metrics=None,
+                 drain_timeout=30, standby_size=0, standby_mode="stop", state=None, boot_grace=600):
+        self.conn = conn
+        self.tag = tag
+        self.public_key_path = public_key_path
+        self.haproxy_host = f"{tag}_haproxy"
+        self.drain_timeout = drain_timeout
+        self.metrics = metrics or METRICS
+        self.inventory_path = inventory_path or inventory_file()
+        self.config_path = ssh_config_file(tag)
+        # Set once the load balancer has been synced by this process.
+        self.lb_synced = False
+        # The standby refill thread writes the config too.
+        self._config_lock = threading.Lock()
+        # Confirmed-dead hosts whose deletion is in progress, and the ones
+        # kept in MAINT because the circuit breaker refused to replace them.
+        self.retiring = set()
+        self.disabled = set()
+        self.breaker = CircuitBreaker()
+        # When this process created or promoted each webserver.
+        self.boot_grace = boot_grace
+        self._started_at = {}
+
+        self.state = state
+
+        logging.info("Get the information of the keypair, network and webserver security group.")
+        known = state.restore_resources(conn) if state else {}
+        self.keypair = known.get("keypair") or create_or_get_keypair(tag, public_key_path, conn, log=False)
+        if all(kind in known for kind in ("network", "subnet", "router")):
+            self.network, self.subnet, self.router = known["network"], known["subnet"], known["router"]
+        else:
+            self.network, self.subnet, self.router = create_or_get_network(tag, conn, log=False)
+        self.web_sg = known.get("security_group:webservers") or create_or_get_webservers_security_group(
+            tag, conn, log=False
+        )
+        if state:
+            state.save_resources({
+                "keypair": self.keypair,
+                "network": self.network,
+                "subnet": self.subnet,
+                "router": self.router,
+                "security_group:webservers": self.web_sg,
+            })
+        if cache is None:
+            cache = ResourceCache(conn, tag, network=self.network)
+            servers, changes_since = state.restore_servers() if state else ([], None)
+            if changes_since:
+                logging.info("Resuming from %d recorded servers, changed since %s.", len(servers), changes_since)
+                cache.seed(servers, changes_since)
+        self.cache = cache
+        logging.info("Get the floating IP for the haproxy server.")
+        recorded_ip = state.floating_ip(self.haproxy_host) if state else None
+        if recorded_ip:
+            self.floating_ip = [recorded_ip]
+        else:
+            self.floating_ip = get_floating_ip_for_server(conn, self.haproxy_host, cache=self.cache)
+            if state and self.floating_ip:
+                state.set_floating_ip(self.cache.find_server(self.haproxy_host), self.floating_ip[0])
+        self.standby = StandbyPool(self, standby_size, standby_mode) if standby_size else None
+
+    def write_config(self):
+        """
+        Regenerate the hosts file and SSH config from the current servers.
+
+        Returns:
+            (server_names_ip_dict, diff) where diff lists the "added",
+            "removed" and "changed" hosts.
+        """
+        with self._config_lock:
+            with self.metrics.phase("list"):
+                # Dead servers being deleted must not come back into rotation.
+                total_servers = [server for server in self.cache.servers() if server.name not in self.retiring]
+                server_names_ip_dict = extract_names_ips_from_server(total_servers, self.tag)
+            with self.metrics.phase("config write"):
+                diff = write_ansible_and_ssh_config(
+                    server_names_ip_dict,
+                    self.tag,
+                    abs_path(self.public_key_path)[:-4],
+                    inventory_path=self.inventory_path
+                )
+            if self.state:
+                self.state.save_servers(total_servers, server_names_ip_dict, self.cache.last_synced())
+        return server_names_ip_dict, diff
+
+    def sync_haproxy(self, server_names_ip_dict):
+        """
+        Update the running HAProxy backend in place and push the locally rendered
+        HAProxy/Nginx configs, reloading HAProxy only if the runtime API failed.
+        """
+        haproxy_host = self.haproxy_host
+        webservers = get_webserver_ips(server_names_ip_dict, self.tag)
+        with self.metrics.phase("lb sync"):
+            runtime_ok = sync_backend(self.config_path, haproxy_host, webservers)
+            try:
+                push_lb_configs(self.config_path, haproxy_host, webservers, reload_haproxy=not runtime_ok)
+                self.lb_synced = True
+                return
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                logging.error("Could not push the load balancer configs: %s", e)
+        logging.warning("Falling back to the haproxy playbook.")
+        with self.metrics.phase("playbook"):
+            run_ansible_playbook(
+                inventory_path=self.inventory_path,
+                config_path=self.config_path,
+                playbook_path=abs_path("./site.yaml"),
+                tags=["haproxy", "gather_facts"]
+            )
+        self.lb_synced = True
+
+    def missing_from_lb(self, hosts):
+        """
+        Hosts of `hosts` that the HAProxy backend does not have, e.g. baked
+        servers that missed their readiness deadline and serve now.
+
+        A burst of requests through the HAProxy frontend comes first; the
+        backend is only read over SSH when some host did not answer there.
+        """
+        if self.floating_ip:
+            served = probe_haproxy_backends(f"http://{self.floating_ip[0]}:5000", expected_hosts=hosts)
+            if set(hosts) <= set(served):
+                return []
+        try:
+            backend = show_backend_servers(self.config_path, self.haproxy_host)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            logging.warning("Could not compare the HAProxy backend with the inventory: %s", e)
+            return []
+        return sorted(set(hosts) - set(serving_slots(backend)))
+
+    def choose_victims(self, hosts, count):
+        """
+        Pick the least loaded hosts to remove, by name if the load is unknown.
+        """
+        try:
+            stats = read_backend_stats(self.config_path, self.haproxy_host)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            logging.error("Could not read HAProxy stats to pick servers to remove: %s", e)
+            stats = None
+        return pick_scale_down_victims(hosts, count, stats)
+
+    def scale_down(self, victims):
+        """
+        Take the victims out of rotation gracefully and delete them together:
+        drain them in HAProxy, wait for their sessions to finish (or the
+        deadline), park as many as the standby pool has room for, delete the
+        rest with one batched wait, then resync. Victims HAProxy could not
+        drain are left alone until the next pass, and victims that could not
+        be deleted go back into rotation.
+        """
+        with self.metrics.phase("drain"):
+            if not drain_servers(self.config_path, self.haproxy_host, victims):
+                logging.error("Could not drain %s, not removing them in this pass.", ", ".join(victims))
+                return
+            wait_for_drain(self.config_path, self.haproxy_host, victims, timeout=self.drain_timeout)
+        servers = []
+        for server_name in victims:
+            server = self.cache.find_server(server_name)
+            if server:
+                servers.append(server)
+            else:
+                logging.warning("Server %s not found.", server_name)
+        if self.standby:
+            with self.metrics.phase("demote"):
+                demoted = self.standby.demote(servers)
+            if demoted:
+                logging.info("Moved %s to the standby pool.", ", ".join(demoted))
+            servers = [server for server in servers if server.name not in demoted]
+        with self.metrics.phase("delete"):
+            deleted, failed = delete_servers(self.conn, servers, cache=self.cache)
+        logging.info("Deleted %d of %d servers which are not required.", len(deleted), len(servers))
+        if failed:
+            logging.warning("Putting %s back into rotation until they can be deleted.", ", ".join(sorted(failed)))
+            set_servers_state(self.config_path, self.haproxy_host, sorted(failed), "ready")
+        logging.info("Updating the hosts file and config file.")
+        server_names_ip_dict, _ = self.write_config()
+        logging.info("Updating the haproxy configuration.")
+        self.sync_haproxy(server_names_ip_dict)
+
+    def mark_started(self, names):
+        """
+        Start the grace period of new webservers. A host still booting from
+        an earlier pass keeps its original start.
+        """
+        now = time.monotonic()
+        for name in names:
+            self._started_at.setdefault(name, now)
+
+    def young_hosts(self):
+        """
+        Hosts created or promoted less than `boot_grace` seconds ago.
+        """
+        now = time.monotonic()
+        for name in [name for name, at in self._started_at.items() if now - at >= self.boot_grace]:
+            del self._started_at[name]
+        return set(self._started_at)
+
+    def retire(self, dead, servers, pool_size):
+        """
+        Take confirmed-dead hosts out of rotation at once and, unless the
+        circuit breaker refuses, start deleting them in the background so
+        their replacements can boot at the same time.
+
+        Returns:
+            the deletion thread to join, or None.
+        """
+        logging.info("Taking dead hosts out of rotation: %s", ", ".join(dead))
+        with self.metrics.phase("lb sync"):
+            disable_servers(self.config_path, self.haproxy_host, dead)
+        if not self.breaker.allow(len(dead), pool_size):
+            logging.warning("Not replacing %s while the circuit breaker is open.", ", ".join(dead))
+            self.disabled.update(dead)
+            return None
+        self.disabled.difference_update(dead)
+        self.retiring.update(dead)
+        for name in dead:
+            self._started_at.pop(name, None)
+        doomed = [server for server in servers.values() if server]
+
+        def delete():
+            with self.metrics.activate():
+                try:
+                    delete_servers(self.conn, doomed, cache=self.cache)
+                finally:
+                    self.retiring.difference_update(dead)
+
+        thread = threading.Thread(target=delete, name=f"retire-{self.tag}", daemon=True)
+        thread.start()
+        return thread
+
+    def reconcile(self, no_of_servers_required):
+        """
+        Run one reconciliation pass.
+
+        Unreachable hosts confirmed dead are pulled from rotation and deleted
+        while their replacements are created, within the same pass.
+
+        Returns:
+            True when the pass found the pool healthy at the requested size,
+            False when it had to act or something is still unreachable.
+        """
+        logging.info("Checking the reachability of the servers over HTTP through the bastion.")
+        with self.metrics.phase("probe"):
+            unreachable_hosts, reachable_hosts = check_hosts_status(self.inventory_path, self.config_path)
+        if self.state:
+            self.state.record_health(reachable_hosts, unreachable_hosts)
+        recovered = sorted(self.disabled & set(reachable_hosts))
+        if recovered:
+            logging.info("Putting recovered hosts back into rotation: %s", ", ".join(recovered))
+            if set_servers_state(self.config_path, self.haproxy_host, recovered, "ready"):
+                self.disabled.difference_update(recovered)
+        retiring = None
+        if unreachable_hosts:
+            with self.metrics.phase("confirm"):
+                dead, dead_servers = confirm_failures(
+                    self.cache, self.config_path, self.haproxy_host, f"{self.tag}_bastion", unreachable_hosts,
+                    grace_hosts=self.young_hosts(),
+                    grace=self.boot_grace
+                )
+            if dead:
+                retiring = self.retire(dead, dead_servers, len(reachable_hosts) + len(unreachable_hosts))
+        try:
+            return self._converge(no_of_servers_required, reachable_hosts, unreachable_hosts)
+        finally:
+            if retiring:
+                with self.metrics.phase("delete"):
+                    retiring.join()
+
+    def _converge(self, no_of_servers_required, reachable_hosts, unreachable_hosts):
+        conn = self.conn
+        tag = self.tag
+        if len(reachable_hosts) == no_of_servers_required:
+            logging.info("We have required number of servers i.e %d", no_of_servers_required)
+            if len(unreachable_hosts) > 0:
+                logging.info("We have some unreachable hosts, so update the hosts file, config file and update the haproxy configuration.")
+                server_names_ip_dict, diff = self.write_config()
+                if self.lb_synced and not any(diff.values()):
+                    logging.info("Membership unchanged, the haproxy configuration is already current.")
+                    return False
+                logging.info("Updating the haproxy configuration.")
+                self.sync_haproxy(server_names_ip_dict)
+                return False
+            if self.standby:
+                self.standby.refill_async()
+            with self.metrics.phase("lb check"):
+                missing = self.missing_from_lb(reachable_hosts)
+            if missing:
+                logging.info("Adding %s, which serve now, to the haproxy configuration.", ", ".join(missing))
+                server_names_ip_dict, _ = self.write_config()
+                self.sync_haproxy(server_names_ip_dict)
+                return False
+            return True
+
+        elif len(reachable_hosts) < no_of_servers_required:
+            logging.info("We have only %d but we need %d of servers.", len(reachable_hosts), no_of_servers_required)
+            server_names_to_create = give_server_name_to_create(
+                no_of_servers_required,
+                reachable_hosts,
+                tag,
+                exclude=self.retiring
+            )
+            held = [name for name in server_names_to_create if name in self.disabled]
+            if held:
+                # Dead hosts the circuit breaker kept: their names stay taken.
+                logging.warning("Not recreating %s while the circuit breaker is open.", ", ".join(held))
+                server_names_to_create = [name for name in server_names_to_create if name not in held]
+            if not server_names_to_create:
+                server_names_ip_dict, _ = self.write_config()
+                self.sync_haproxy(server_names_ip_dict)
+                return False
+            promoted = []
+            if self.standby:
+                with self.metrics.phase("promote"):
+                    promoted = self.standby.promote(server_names_to_create)
+                server_names_to_create = [name for name in server_names_to_create if name not in promoted]
+                self.standby.refill_async()
+            self.mark_started(promoted)
+            baked_image_id = load_baked_image_id(tag)
+            created_servers, failed_servers = {}, []
+            if server_names_to_create:
+                if baked_image_id:
+                    # The baked image is already configured and serves on boot.
+                    image, user_data = baked_image_id, None
+                else:
+                    image = IMAGE_NAME
+                    user_data = base64.b64encode(WEBSERVER_USER_DATA.encode()).decode()
+                logging.info("Creating servers: %s", ", ".join(server_names_to_create))
+                with self.metrics.phase("create"):
+                    created_servers, failed_servers = create_servers(conn,
+                                            server_names_to_create,
+                                            tag,
+                                            self.network,
+                                            self.keypair,
+                                            self.web_sg,
+                                            user_data=user_data,
+                                            cache=self.cache,
+                                            image_name_or_id=image)
+                for name in failed_servers:
+                    logging.error("Server %s could not be created, it will be retried on the next pass.", name)
+            elif promoted:
+                logging.info("Promoted standbys %s, no server has to be created.", ", ".join(promoted))
+
+            server_names_ip_dict, _ = self.write_config()
+            new_hosts = [name for name in server_names_to_create if name not in failed_servers]
+            self.mark_started(new_hosts)
+            in_rotation = set()
+
+            def refresh_lb(configured_hosts):
+                # New hosts join as they become ready; failed ones stay out.
+                in_rotation.update(configured_hosts)
+                skipped = (set(new_hosts) | set(promoted)) - in_rotation
+                logging.info("Updating the haproxy configuration.")
+                self.sync_haproxy({
+                    name: ip for name, ip in server_names_ip_dict.items() if name not in skipped
+                })
+
+            if promoted:
+                # A started standby is configured already but only joins the
+                # rotation once its app answers.
+                logging.info("Waiting for the promoted standbys to serve.")
+                with self.metrics.phase("readiness"):
+                    _, not_serving = ReadinessTracker(
+                        conn,
+                        self.config_path,
+                        f"{tag}_bastion",
+                        stages=("http",)
+                    ).wait(
+                        {name: self.cache.find_server(name) for name in promoted},
+                        server_names_ip_dict,
+                        on_ready=refresh_lb
+                    )
+                if not_serving:
+                    logging.error("Promoted standbys %s never served.", ", ".join(not_serving))
+
+            if not new_hosts:
+                if not in_rotation:
+                    refresh_lb([])
+                return False
+
+            def configure(ready_hosts):
+                logging.info("Configuring the new webservers: %s", ", ".join(ready_hosts))
+                with self.metrics.phase("playbook"):
+                    run_incremental_playbook(
+                        inventory_path=self.inventory_path,
+                        config_path=self.config_path,
+                        playbook_path=abs_path("./site.yaml"),
+                        new_hosts=ready_hosts,
+                        refresh_lb=refresh_lb
+                    )
+
+            # A baked server serves once booted; others need SSH for the playbook.
+            tracker = ReadinessTracker(
+                conn,
+                self.config_path,
+                f"{tag}_bastion",
+                stages=("boot", "http") if baked_image_id else ("boot", "ssh")
+            )
+            logging.info("Waiting for the new servers to become ready.")
+            with self.metrics.phase("readiness"):
+                _, not_ready = tracker.wait(
+                    {name: created_servers[name] for name in new_hosts},
+                    server_names_ip_dict,
+                    on_ready=refresh_lb if baked_image_id else configure
+                )
+            if not_ready:
+                logging.error("Servers %s never became ready. Please check the network configuration.",
+                              ", ".join(not_ready))
+            return False
+
+        else:
+            logging.info(
+                "We have more than required number of servers i.e %d but we have %d.", no_of_servers_required, len(reachable_hosts)
+            )
+            victims = self.choose_victims(reachable_hosts, len(reachable_hosts) - no_of_servers_required)
+            logging.info("Removing servers: %s", ", ".join(victims))
+            self.scale_down(victims)
+            return False
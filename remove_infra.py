@@ -1,4 +1,5 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +27,21 @@ def delete_security_groups(tag, conn):
         else:
             logging.info(f"Security group '{name}' not found. Skipping deletion.")
 
+def remove_router_interface(conn, router, subnet):
+    """
+    Detach a subnet from a router. An interface that is already gone (e.g.
+    on a second teardown) counts as removed.
+    """
+    try:
+        conn.network.remove_interface_from_router(router, subnet_id=subnet.id)
+    except Exception as e:
+        # openstacksdk raises NotFoundException, an HttpException with a 404.
+        if getattr(e, "status_code", None) != 404:
+            raise
+        logging.info(f"Router '{router.name}' has no interface on subnet '{subnet.name}'.")
+        return
+    logging.info(f"Removed interface from router '{router.name}'.")
+
 # Delete router interface & router
 def delete_router(tag, conn):
     router_name = f"{tag}router"
@@ -35,8 +51,7 @@ def delete_router(tag, conn):
         subnet = conn.network.find_subnet(subnet_name)
         if subnet:
             try:
-                conn.network.remove_interface_from_router(router, subnet_id=subnet.id)
-                logging.info(f"Removed interface from router '{router_name}'.")
+                remove_router_interface(conn, router, subnet)
             except Exception as e:
                 logging.error(f"Error removing interface from router '{router_name}': {e}")
         try:
@@ -96,10 +111,14 @@ def delete_servers_by_tag(conn, tag):
             conn.compute.delete_server(server.id, ignore_missing=True)
     logging.info(f"Deleted all servers with tag '{tag}'.")
 
-def delete_floating_ips(conn):
+def delete_floating_ips(conn, addresses):
+    """
+    Delete the unattached floating IPs among `addresses`, e.g. the ones a
+    tag's StateStore recorded. Other deployments' IPs are left alone.
+    """
     # List all floating IPs
     floating_ips = conn.network.ips()
-    unattached_fips = [fip for fip in floating_ips if fip.port_id is None]
+    unattached_fips = [fip for fip in floating_ips if fip.port_id is None and fip.floating_ip_address in addresses]
     # Iterate through each floating IP
     for fip in unattached_fips:
         try:
@@ -129,4 +148,164 @@ def cleanup_excess_floating_ips(conn, keep=2):
             conn.network.delete_ip(fip)
             logging.info(f"Deleted floating IP {fip.floating_ip_address}.")
         except Exception as e:
-            logging.error(f"Error deleting floating IP {fip.floating_ip_address}: {e}")
\ No newline at end of file
+            logging.error(f"Error deleting floating IP {fip.floating_ip_address}: {e}")
+
+def _delete_all(items, delete, describe, max_workers=10):
+    """
+    Delete every item in parallel and wait for the whole batch.
+    Returns the number of failures.
+    """
+    items = list(items)
+    if not items:
+        return 0
+    failures = 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = {executor.submit(delete, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                future.result()
+                logging.info(f"Deleted {describe(item)}.")
+            except Exception as e:
+                logging.error(f"Error deleting {describe(item)}: {e}")
+                failures += 1
+    return failures
+
+def run_dependency_graph(steps, max_workers=4):
+    """
+    Run steps as soon as the steps they depend on have finished.
+
+    Args:
+        steps (dict): step name -> (callable, list of step names it waits for).
+
+    Returns:
+        list of step names that raised or reported failures.
+    """
+    done = set()
+    failed = []
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(done) < len(steps):
+            for name, (step, deps) in steps.items():
+                if name not in done and name not in running.values() and all(dep in done for dep in deps):
+                    running[executor.submit(step)] = name
+            if not running:
+                raise ValueError(f"Unsatisfiable dependencies between steps: {sorted(set(steps) - done)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    if future.result():
+                        failed.append(name)
+                except Exception as e:
+                    logging.error(f"Step '{name}' failed: {e}")
+                    failed.append(name)
+                # Dependents still run: a partial failure should not stop the
+                # rest of the teardown from making progress.
+                done.add(name)
+    return failed
+
+def teardown(conn, tag, recorded_ips=(), max_workers=10):
+    """
+    Delete every resource of a deployment, level by level.
+
+    servers -> floating IPs -> ports -> router interface/router -> subnet -> network,
+    with the security groups deleted once the ports are gone and the keypair
+    deleted right away. Each level deletes its resources in parallel and
+    waits for the whole batch before the levels that depend on it start.
+
+    Floating IPs are the ones bound to the deployment's ports plus the
+    unattached ones in `recorded_ips` (the addresses its StateStore kept),
+    never another deployment's.
+    """
+    network = conn.network.find_network(f"{tag}network")
+    subnet = conn.network.find_subnet(f"{tag}subnet")
+    router = conn.network.find_router(f"{tag}router")
+    servers = [server for server in conn.compute.servers() if tag in server.name]
+    ports = list(conn.network.ports(network_id=network.id)) if network else []
+    port_ids = {port.id for port in ports}
+    recorded_ips = set(recorded_ips)
+    floating_ips = [
+        fip for fip in conn.network.ips()
+        if fip.port_id in port_ids or (fip.port_id is None and fip.floating_ip_address in recorded_ips)
+    ]
+
+    def delete_servers():
+        def delete(server):
+            conn.compute.delete_server(server, ignore_missing=True)
+            conn.compute.wait_for_delete(server)
+        return _delete_all(servers, delete, lambda s: f"server '{s.name}'", max_workers)
+
+    def delete_fips():
+        return _delete_all(
+            floating_ips,
+            lambda fip: conn.network.delete_ip(fip, ignore_missing=True),
+            lambda fip: f"floating IP {fip.floating_ip_address}",
+            max_workers
+        )
+
+    def delete_ports():
+        # Router interface and DHCP ports go away with the router and subnet.
+        leftovers = [
+            port for port in conn.network.ports(network_id=network.id)
+            if not (port.device_owner or "").startswith(("network:router_interface", "network:dhcp"))
+        ] if network else []
+        return _delete_all(
+            leftovers,
+            lambda port: conn.network.delete_port(port, ignore_missing=True),
+            lambda port: f"port {port.id}",
+            max_workers
+        )
+
+    def delete_router_step():
+        if not router:
+            logging.info(f"Router '{tag}router' not found.")
+            return 0
+        if subnet:
+            remove_router_interface(conn, router, subnet)
+        conn.network.delete_router(router, ignore_missing=True)
+        logging.info(f"Deleted router '{tag}router'.")
+        return 0
+
+    def delete_subnet_step():
+        if subnet:
+            conn.network.delete_subnet(subnet, ignore_missing=True)
+            logging.info(f"Deleted subnet '{tag}subnet'.")
+        return 0
+
+    def delete_network_step():
+        if network:
+            conn.network.delete_network(network, ignore_missing=True)
+            logging.info(f"Deleted network '{tag}network'.")
+        return 0
+
+    def delete_sgs():
+        sg_names = [f"{tag}-webservers-sg", f"{tag}-haproxy-sg", f"{tag}-bastion-sg"]
+        groups = [sg for sg in (conn.network.find_security_group(name) for name in sg_names) if sg]
+        return _delete_all(
+            groups,
+            lambda sg: conn.network.delete_security_group(sg, ignore_missing=True),
+            lambda sg: f"security group '{sg.name}'",
+            max_workers
+        )
+
+    def delete_keypair_step():
+        delete_keypair(tag, conn)
+        return 0
+
+    steps = {
+        "servers": (delete_servers, []),
+        "floating_ips": (delete_fips, ["servers"]),
+        "ports": (delete_ports, ["servers", "floating_ips"]),
+        "router": (delete_router_step, ["ports"]),
+        "subnet": (delete_subnet_step, ["router"]),
+        "network": (delete_network_step, ["subnet"]),
+        "security_groups": (delete_sgs, ["ports"]),
+        "keypair": (delete_keypair_step, []),
+    }
+    failed = run_dependency_graph(steps)
+    if failed:
+        logging.error(f"Teardown of '{tag}' incomplete, failed steps: {', '.join(failed)}")
+    else:
+        logging.info(f"Teardown of '{tag}' complete.")
+    return failed
@@ -0,0 +1,254 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Clock skew tolerated between this host and Nova when asking for changes.
+CHANGES_SINCE_MARGIN = 60
+
+
+class ResourceCache:
+    """
+    In-memory cache of the servers, ports and floating IPs that belong to one tag,
+    or to the whole tenant when `tag` is None (see TagView).
+
+    Servers are listed with a name filter for the tag and kept up to date with
+    `changes-since` queries, so after the first listing each refresh only
+    returns what changed. Neutron has no equivalent filter, so ports (scoped to
+    the tag network) and floating IPs are re-listed when their TTL expires.
+    """
+
+    def __init__(self, conn, tag, network=None, ttl=30, full_refresh_interval=600):
+        self.conn = conn
+        self.tag = tag
+        self.network = network
+        self.ttl = ttl
+        self.full_refresh_interval = full_refresh_interval
+        self._lock = threading.RLock()
+        self._servers = {}
+        self._ports = {}
+        self._floating_ips = {}
+        self._servers_checked_at = 0
+        self._servers_full_at = 0
+        self._changes_since = None
+        self._network_checked_at = 0
+        # Tags whose servers changed through a TagView since the last refresh.
+        self._stale_tags = set()
+
+    def _server_matches(self, server):
+        return self.tag is None or server.name.startswith(f"{self.tag}_")
+
+    def _list_servers(self, **filters):
+        if self.tag is not None:
+            filters["name"] = f"^{self.tag}_"
+        return self.conn.compute.servers(**filters)
+
+    def refresh_servers(self, force=False):
+        """
+        Bring the server view up to date, incrementally when possible.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._servers_checked_at < self.ttl:
+                return
+            started = datetime.now(timezone.utc)
+            full = self._changes_since is None or now - self._servers_full_at > self.full_refresh_interval
+            if full:
+                servers = {
+                    server.id: server
+                    for server in self._list_servers()
+                    if self._server_matches(server)
+                }
+                self._servers = servers
+                self._servers_full_at = now
+                logging.debug(f"Listed {len(servers)} servers for tag '{self.tag or '*'}'.")
+            else:
+                changed = list(self._list_servers(changes_since=self._changes_since))
+                for server in changed:
+                    if not self._server_matches(server):
+                        continue
+                    if server.status == "DELETED":
+                        self._servers.pop(server.id, None)
+                    else:
+                        self._servers[server.id] = server
+                logging.debug(f"{len(changed)} servers changed for tag '{self.tag or '*'}'.")
+            since = started - timedelta(seconds=CHANGES_SINCE_MARGIN)
+            self._changes_since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+            self._servers_checked_at = now
+
+    def refresh_network(self, force=False):
+        """
+        Re-list the ports on the tag network and the floating IPs bound to them.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._network_checked_at < self.ttl:
+                return
+            if self.network is not None:
+                ports = self.conn.network.ports(network_id=self.network.id)
+            else:
+                self.refresh_servers()
+                server_ids = set(self._servers)
+                ports = (port for port in self.conn.network.ports() if port.device_id in server_ids)
+            self._ports = {port.id: port for port in ports}
+            self._floating_ips = {
+                fip.id: fip
+                for fip in self.conn.network.ips()
+                if fip.port_id in self._ports
+            }
+            self._network_checked_at = now
+
+    def invalidate(self, tag=None):
+        """
+        Mark everything stale so the next read goes back to the cloud.
+
+        With a `tag`, only that tag's servers are marked: the next read
+        through its TagView asks Nova what changed for that tag's names
+        since the last refresh, and the other tags keep their view.
+        """
+        with self._lock:
+            if tag is None or self._changes_since is None:
+                self._servers_checked_at = 0
+                self._network_checked_at = 0
+            else:
+                self._stale_tags.add(tag)
+
+    def refresh_tag(self, tag):
+        """
+        Bring one tag's servers up to date after invalidate(tag), along with
+        the ports and floating IPs of the servers that changed.
+        """
+        with self._lock:
+            if tag not in self._stale_tags:
+                return
+            self._stale_tags.discard(tag)
+            changed = [
+                server
+                for server in self.conn.compute.servers(name=f"^{tag}_", changes_since=self._changes_since)
+                if server.name.startswith(f"{tag}_")
+            ]
+            for server in changed:
+                for port_id in [port.id for port in self._ports.values() if port.device_id == server.id]:
+                    del self._ports[port_id]
+                    for fip_id in [fip.id for fip in self._floating_ips.values() if fip.port_id == port_id]:
+                        del self._floating_ips[fip_id]
+                if server.status == "DELETED":
+                    self._servers.pop(server.id, None)
+                    continue
+                self._servers[server.id] = server
+                if not self._network_checked_at:
+                    # The next refresh_network lists everything anyway.
+                    continue
+                for port in self.conn.network.ports(device_id=server.id):
+                    self._ports[port.id] = port
+                    for fip in self.conn.network.ips(port_id=port.id):
+                        self._floating_ips[fip.id] = fip
+            logging.debug(f"{len(changed)} servers changed for tag '{tag}'.")
+
+    def last_synced(self):
+        """
+        The `changes-since` marker the current server view is complete up to,
+        or None before the first listing.
+        """
+        with self._lock:
+            return self._changes_since
+
+    def seed(self, servers, changes_since):
+        """
+        Start from servers known as of `changes_since` (e.g. restored from a
+        StateStore), so the first refresh only asks Nova what changed since.
+        A seed older than `full_refresh_interval` is listed in full anyway.
+        """
+        since = datetime.strptime(changes_since, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - since).total_seconds()
+        with self._lock:
+            self._servers = {server.id: server for server in servers if self._server_matches(server)}
+            self._changes_since = changes_since
+            self._servers_full_at = time.monotonic() - age
+            self._servers_checked_at = 0
+
+    def servers(self):
+        self.refresh_servers()
+        with self._lock:
+            return list(self._servers.values())
+
+    def find_server(self, name):
+        for server in self.servers():
+            if server.name == name:
+                return server
+        return None
+
+    def ports(self, device_id=None):
+        self.refresh_network()
+        with self._lock:
+            return [
+                port for port in self._ports.values()
+                if device_id is None or port.device_id == device_id
+            ]
+
+    def floating_ips(self, port_id=None):
+        self.refresh_network()
+        with self._lock:
+            return [
+                fip for fip in self._floating_ips.values()
+                if port_id is None or fip.port_id == port_id
+            ]
+
+
+class TagView:
+    """
+    One tag's slice of a tenant-wide ResourceCache, with the same read
+    interface, so several deployments can share one listing of the tenant.
+    """
+
+    def __init__(self, cache, tag):
+        self.cache = cache
+        self.tag = tag
+
+    def _matches(self, server):
+        return server.name.startswith(f"{self.tag}_")
+
+    def refresh_servers(self, force=False):
+        self.cache.refresh_servers(force)
+
+    def refresh_network(self, force=False):
+        self.cache.refresh_network(force)
+
+    def invalidate(self):
+        # Only this tag changed; the other deployments keep the shared view.
+        self.cache.invalidate(self.tag)
+
+    def last_synced(self):
+        return self.cache.last_synced()
+
+    def servers(self):
+        self.cache.refresh_tag(self.tag)
+        return [server for server in self.cache.servers() if self._matches(server)]
+
+    def find_server(self, name):
+        if not name.startswith(f"{self.tag}_"):
+            return None
+        for server in self.servers():
+            if server.name == name:
+                return server
+        return None
+
+    def ports(self, device_id=None):
+        self.cache.refresh_tag(self.tag)
+        if device_id is not None:
+            return self.cache.ports(device_id=device_id)
+        server_ids = {server.id for server in self.servers()}
+        return [port for port in self.cache.ports() if port.device_id in server_ids]
+
+    def floating_ips(self, port_id=None):
+        self.cache.refresh_tag(self.tag)
+        if port_id is not None:
+            return self.cache.floating_ips(port_id=port_id)
+        port_ids = {port.id for port in self.ports()}
+        return [fip for fip in self.cache.floating_ips() if fip.port_id in port_ids]
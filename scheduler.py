@@ -0,0 +1,105 @@
+import os
+import time
+import random
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class ReconcileScheduler:
+    """
+    Decide when the next reconciliation pass should run.
+
+    A pass is triggered by whichever comes first:
+    - a change to servers.conf, noticed within `watch_interval` seconds,
+    - the probe interval, which drops to `min_interval` after an unhealthy
+      pass and doubles up to `max_interval` while the pool stays healthy,
+    - the retry delay after a cloud error: exponential backoff with full
+      jitter, capped at `max_backoff`.
+    """
+
+    def __init__(self, conf_path, min_interval=5, max_interval=120, base_backoff=2, max_backoff=300,
+                 watch_interval=0.5):
+        self.conf_path = conf_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.watch_interval = watch_interval
+        self.interval = min_interval
+        self.errors = 0
+        self.next_run = time.monotonic()
+        # Count of the last servers.conf that parsed.
+        self.desired_count = None
+        # Taken now so that a caller which never reads the count (autoscale
+        # mode) does not see servers.conf as changed after every pass.
+        self._conf_stamp = self._stat_conf()
+
+    def _stat_conf(self):
+        try:
+            st = os.stat(self.conf_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def read_desired_count(self):
+        """
+        Read the required number of servers and remember the file version seen.
+
+        A file caught mid-write or holding no number keeps the last good
+        count; only the very first read raises.
+        """
+        self._conf_stamp = self._stat_conf()
+        try:
+            with open(self.conf_path) as f:
+                count = int(f.read().strip())
+        except (OSError, ValueError) as e:
+            if self.desired_count is None:
+                raise
+            logging.error("Could not read %s (%s), keeping %d servers.", self.conf_path, e, self.desired_count)
+            return self.desired_count
+        self.desired_count = count
+        return count
+
+    def conf_changed(self):
+        return self._stat_conf() != self._conf_stamp
+
+    def report_pass(self, healthy):
+        """
+        Adapt the probe interval to the outcome of a completed pass.
+        """
+        self.errors = 0
+        if healthy:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+        self.next_run = time.monotonic() + self.interval
+
+    def report_error(self):
+        """
+        Back off after a cloud error, with full jitter to spread retries out.
+        """
+        self.errors += 1
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** self.errors))
+        self.interval = self.min_interval
+        self.next_run = time.monotonic() + delay
+        return delay
+
+    def wait(self):
+        """
+        Block until the next pass is due.
+
+        Returns:
+            "conf-changed" if servers.conf was edited, otherwise "timer".
+        """
+        while True:
+            if self.conf_changed():
+                return "conf-changed"
+            remaining = self.next_run - time.monotonic()
+            if remaining <= 0:
+                return "timer"
+            time.sleep(min(self.watch_interval, remaining))
@@ -5,39 +5,139 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s: %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
-def create_or_get_bastion_security_group(tag, conn, log=True):
+
+# Ingress rules per group role. "remote_group" names the role of the group
+# allowed in; any other rule is open to "remote_ip_prefix".
+SECURITY_GROUPS = {
+    "bastion": {
+        "description": "Security group for bastion host allowing SSH",
+        "rules": [
+            {"protocol": "tcp", "port": 22, "remote_ip_prefix": "0.0.0.0/0"},
+        ],
+    },
+    "haproxy": {
+        "description": "HAProxy security group with TCP/UDP and restricted SSH access",
+        "rules": [
+            {"protocol": "tcp", "port": 5000, "remote_ip_prefix": "0.0.0.0/0"},
+            {"protocol": "udp", "port": 6000, "remote_ip_prefix": "0.0.0.0/0"},
+            {"protocol": "tcp", "port": 22, "remote_group": "bastion"},
+        ],
+    },
+    "webservers": {
+        "description": "Security group for web servers with HAProxy and Bastion access",
+        "rules": [
+            {"protocol": "udp", "port": 161, "remote_group": "haproxy"},
+            {"protocol": "tcp", "port": 5000, "remote_group": "haproxy"},
+            {"protocol": "tcp", "port": 22, "remote_group": "bastion"},
+        ],
+    },
+}
+
+_RULE_FIELDS = ("direction", "ethertype", "protocol", "port_range_min", "port_range_max",
+                "remote_ip_prefix", "remote_group_id")
+
+def _rule_key(rule):
     """
-    Create a simple security group for a bastion host that allows only SSH (port 22) from any IP.
+    Comparable identity of a rule, from attribute dict or SDK resource.
     """
-    sg_name = f"{tag}-bastion-sg"
-    
-    # Check if the security group already exists
+    if isinstance(rule, dict):
+        return tuple(rule.get(field) for field in _RULE_FIELDS)
+    return tuple(getattr(rule, field, None) for field in _RULE_FIELDS)
+
+def desired_rules(tag, role, conn, groups=None):
+    """
+    Resolve the declared rules of a role into Neutron rule attributes.
+
+    Remote groups are looked up in `groups` (group name -> security group)
+    when given, otherwise in Neutron. Rules whose remote group does not exist
+    yet are left out; they are added by a later sync once that group has
+    been created.
+    """
+    rules = []
+    remotes = dict(groups or {})
+    for rule in SECURITY_GROUPS[role]["rules"]:
+        attrs = {
+            "direction": "ingress",
+            "ethertype": "IPv4",
+            "protocol": rule["protocol"],
+            "port_range_min": rule["port"],
+            "port_range_max": rule["port"],
+            "remote_ip_prefix": rule.get("remote_ip_prefix"),
+            "remote_group_id": None,
+        }
+        if "remote_group" in rule:
+            remote_name = f"{tag}-{rule['remote_group']}-sg"
+            if remote_name not in remotes:
+                remotes[remote_name] = conn.network.find_security_group(remote_name)
+            remote = remotes[remote_name]
+            if not remote:
+                logging.error(f"Security group '{remote_name}' not found. Skipping {rule['protocol']}/{rule['port']} rule.")
+                continue
+            attrs["remote_group_id"] = remote.id
+        rules.append(attrs)
+    return rules
+
+def diff_security_group_rules(live_rules, rules):
+    """
+    Compare live ingress rules with desired rule attributes.
+
+    Returns:
+        (missing, stale): the desired rules not in place and the live rules
+        that are not desired.
+    """
+    live = {_rule_key(rule): rule for rule in live_rules}
+    wanted = {_rule_key(rule): rule for rule in rules}
+    missing = [rule for key, rule in wanted.items() if key not in live]
+    stale = [rule for key, rule in live.items() if key not in wanted]
+    return missing, stale
+
+def sync_security_group_rules(conn, sg, rules, log=True, live_rules=None):
+    """
+    Make the ingress rules of `sg` match `rules`: the missing ones are created
+    in one bulk request and the ones not declared are deleted. `live_rules`
+    saves listing the group's rules when the caller already has them.
+
+    Returns:
+        (created, deleted) rule counts.
+    """
+    if live_rules is None:
+        live_rules = conn.network.security_group_rules(security_group_id=sg.id, direction="ingress")
+    missing, stale = diff_security_group_rules(live_rules, rules)
+    missing = [dict(rule, security_group_id=sg.id) for rule in missing]
+    if missing:
+        conn.network.create_security_group_rules(missing)
+    for rule in stale:
+        conn.network.delete_security_group_rule(rule, ignore_missing=True)
+    if log and (missing or stale):
+        logging.info(f"Security group '{sg.name}': {len(missing)} rules added, {len(stale)} removed.")
+    return len(missing), len(stale)
+
+def create_or_get_security_group(tag, conn, role, log=True):
+    """
+    Create the security group of a role if needed and bring its rules in line
+    with SECURITY_GROUPS, repairing groups created with missing rules.
+    """
+    sg_name = f"{tag}-{role}-sg"
     sg = conn.network.find_security_group(sg_name)
     if sg:
         if log:
             logging.info(f"Security group '{sg_name}' already exists.")
-        return sg
-
-    # Create the security group
-    sg = conn.network.create_security_group(
-        name=sg_name, 
-        description="Security group for bastion host allowing SSH"
-    )
-    logging.info(f"Created security group '{sg_name}'.")
-
-    # Add SSH rule
-    conn.network.create_security_group_rule(
-        security_group_id=sg.id,
-        direction='ingress',
-        protocol='tcp',
-        port_range_min=22,
-        port_range_max=22,
-        remote_ip_prefix='0.0.0.0/0',
-        ethertype='IPv4'
-    )
+    else:
+        sg = conn.network.create_security_group(
+            name=sg_name,
+            description=SECURITY_GROUPS[role]["description"]
+        )
+        logging.info(f"Created security group '{sg_name}'.")
 
+    sync_security_group_rules(conn, sg, desired_rules(tag, role, conn), log=log)
     return sg
 
+def create_or_get_bastion_security_group(tag, conn, log=True):
+    """
+    Create a simple security group for a bastion host that allows only SSH (port 22) from any IP.
+    """
+    return create_or_get_security_group(tag, conn, "bastion", log=log)
+
 def create_or_get_haproxy_security_group(tag, conn, log=True):
     """
     Create a security group for HAProxy:
@@ -45,60 +145,7 @@ def create_or_get_haproxy_security_group(tag, conn, log=True):
     - Allow UDP port 6000 from anywhere
     - Allow SSH (port 22) only from bastion security group
     """
-    sg_name = f"{tag}-haproxy-sg"
-    
-    # Check if already exists
-    sg = conn.network.find_security_group(sg_name)
-    if sg:
-        if log:
-            logging.info(f"Security group '{sg_name}' already exists.")
-        return sg
-
-    # Create the security group
-    sg = conn.network.create_security_group(
-        name=sg_name, 
-        description="HAProxy security group with TCP/UDP and restricted SSH access"
-    )
-    logging.info(f"Created security group '{sg_name}'.")
-
-    # Allow TCP 5000 from anywhere
-    conn.network.create_security_group_rule(
-        security_group_id=sg.id,
-        direction='ingress',
-        protocol='tcp',
-        port_range_min=5000,
-        port_range_max=5000,
-        remote_ip_prefix='0.0.0.0/0',
-        ethertype='IPv4'
-    )
-
-    # Allow UDP 6000 from anywhere
-    conn.network.create_security_group_rule(
-        security_group_id=sg.id,
-        direction='ingress',
-        protocol='udp',
-        port_range_min=6000,
-        port_range_max=6000,
-        remote_ip_prefix='0.0.0.0/0',
-        ethertype='IPv4'
-    )
-
-    # Allow SSH (22) only from bastion SG
-    bastion_sg = conn.network.find_security_group(f"{tag}-bastion-sg")
-    if bastion_sg:
-        conn.network.create_security_group_rule(
-            security_group_id=sg.id,
-            direction='ingress',
-            protocol='tcp',
-            port_range_min=22,
-            port_range_max=22,
-            remote_group_id=bastion_sg.id,
-            ethertype='IPv4'
-        )
-    else:
-        logging.raiseExceptions(f"Bastion security group '{tag}-bastion-sg' not found. Skipping SSH rule.")
-
-    return sg
+    return create_or_get_security_group(tag, conn, "haproxy", log=log)
 
 
 def create_or_get_webservers_security_group(tag, conn, log=True):
@@ -108,63 +155,4 @@ def create_or_get_webservers_security_group(tag, conn, log=True):
     - Allow TCP 5000 from HAProxy security group
     - Allow SSH (22) from Bastion security group
     """
-    sg_name = f"{tag}-webservers-sg"
-
-    # Check if security group already exists
-    sg = conn.network.find_security_group(sg_name)
-    if sg:
-        if log:
-            logging.info(f"Security group '{sg_name}' already exists.")
-        return sg
-
-    # Create the security group
-    sg = conn.network.create_security_group(
-        name=sg_name,
-        description="Security group for web servers with HAProxy and Bastion access"
-    )
-    logging.info(f"Created security group '{sg_name}'.")
-
-    # Get HAProxy SG
-    haproxy_sg = conn.network.find_security_group(f"{tag}-haproxy-sg")
-    if not haproxy_sg:
-        logging.error(f"HAProxy security group '{tag}-haproxy-sg' not found. Skipping HAProxy rules.")
-    else:
-        # Allow UDP 161 from HAProxy SG
-        conn.network.create_security_group_rule(
-            security_group_id=sg.id,
-            direction='ingress',
-            protocol='udp',
-            port_range_min=161,
-            port_range_max=161,
-            remote_group_id=haproxy_sg.id,
-            ethertype='IPv4'
-        )
-        
-        # Allow TCP 5000 from HAProxy SG
-        conn.network.create_security_group_rule(
-            security_group_id=sg.id,
-            direction='ingress',
-            protocol='tcp',
-            port_range_min=5000,
-            port_range_max=5000,
-            remote_group_id=haproxy_sg.id,
-            ethertype='IPv4'
-        )
-        
-    # Get Bastion SG
-    bastion_sg = conn.network.find_security_group(f"{tag}-bastion-sg")
-    if not bastion_sg:
-        logging.error(f"Bastion security group '{tag}-bastion-sg' not found. Skipping SSH rule.")
-    else:
-        # Allow SSH from Bastion SG
-        conn.network.create_security_group_rule(
-            security_group_id=sg.id,
-            direction='ingress',
-            protocol='tcp',
-            port_range_min=22,
-            port_range_max=22,
-            remote_group_id=bastion_sg.id,
-            ethertype='IPv4'
-        )
-
-    return sg
\ No newline at end of file
+    return create_or_get_security_group(tag, conn, "webservers", log=log)
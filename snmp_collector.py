@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import shlex
+import select
+import socket
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# UCD-SNMP-MIB objects exposed by the systemonly view in snmpd.conf.j2.
+METRIC_OIDS = {
+    "cpu_idle": "1.3.6.1.4.1.2021.11.11.0",     # ssCpuIdle, percent
+    "load_1m": "1.3.6.1.4.1.2021.10.1.5.1",     # laLoadInt.1, load average * 100
+    "mem_total": "1.3.6.1.4.1.2021.4.5.0",      # memTotalReal, kB
+    "mem_available": "1.3.6.1.4.1.2021.4.6.0",  # memAvailReal, kB
+    "mem_buffer": "1.3.6.1.4.1.2021.4.14.0",    # memBuffer, kB
+    "mem_cached": "1.3.6.1.4.1.2021.4.15.0",    # memCached, kB
+}
+
+_SEQUENCE = 0x30
+_INTEGER = 0x02
+_OCTET_STRING = 0x04
+_NULL = 0x05
+_OID = 0x06
+_GET_REQUEST = 0xA0
+_GET_RESPONSE = 0xA2
+_UNSIGNED_TYPES = (0x41, 0x42, 0x43, 0x46)  # Counter32, Gauge32, TimeTicks, Counter64
+
+# Where site.yaml installs the collector on the haproxy host and where it
+# writes what it collected.
+HAPROXY_CFG = "/etc/haproxy/haproxy.cfg"
+METRICS_PATH = "/var/lib/snmp-collector/metrics.json"
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    data = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(data)]) + data
+
+
+def _tlv(tag, payload):
+    return bytes([tag]) + _encode_length(len(payload)) + payload
+
+
+def _encode_int(value):
+    return _tlv(_INTEGER, value.to_bytes(max(1, (value.bit_length() + 8) // 8), "big", signed=True))
+
+
+def _encode_oid(oid):
+    parts = [int(part) for part in oid.split(".")]
+    data = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        data.extend(reversed(chunk))
+    return _tlv(_OID, bytes(data))
+
+
+def _decode_oid(data):
+    parts = [data[0] // 40, data[0] % 40]
+    value = 0
+    for byte in data[1:]:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    return ".".join(str(part) for part in parts)
+
+
+def _read_tlv(data, offset):
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    return tag, data[offset:offset + length], offset + length
+
+
+def build_get_request(community, request_id, oids):
+    """
+    Encode an SNMPv2c GetRequest carrying every OID in one PDU.
+    """
+    varbinds = b"".join(_tlv(_SEQUENCE, _encode_oid(oid) + _tlv(_NULL, b"")) for oid in oids)
+    pdu = _tlv(_GET_REQUEST, _encode_int(request_id) + _encode_int(0) + _encode_int(0) + _tlv(_SEQUENCE, varbinds))
+    return _tlv(_SEQUENCE, _encode_int(1) + _tlv(_OCTET_STRING, community.encode()) + pdu)
+
+
+def parse_response(packet):
+    """
+    Decode an SNMPv2c response.
+
+    Returns:
+        (request_id, {oid: value}) where missing objects have the value None.
+    """
+    _, message, _ = _read_tlv(packet, 0)
+    _, _, offset = _read_tlv(message, 0)           # version
+    _, _, offset = _read_tlv(message, offset)      # community
+    tag, pdu, _ = _read_tlv(message, offset)
+    if tag != _GET_RESPONSE:
+        raise ValueError(f"Unexpected PDU type {tag:#x}")
+    _, request_id, offset = _read_tlv(pdu, 0)
+    _, error_status, offset = _read_tlv(pdu, offset)
+    _, _, offset = _read_tlv(pdu, offset)          # error index
+    if int.from_bytes(error_status, "big"):
+        raise ValueError(f"SNMP error status {int.from_bytes(error_status, 'big')}")
+    _, varbinds, _ = _read_tlv(pdu, offset)
+    values = {}
+    offset = 0
+    while offset < len(varbinds):
+        _, varbind, offset = _read_tlv(varbinds, offset)
+        _, oid, inner = _read_tlv(varbind, 0)
+        tag, raw, _ = _read_tlv(varbind, inner)
+        if tag == _INTEGER:
+            value = int.from_bytes(raw, "big", signed=True)
+        elif tag in _UNSIGNED_TYPES:
+            value = int.from_bytes(raw, "big")
+        elif tag == _OCTET_STRING:
+            value = raw.decode(errors="replace")
+        else:
+            value = None  # NULL, noSuchObject, noSuchInstance, endOfMibView
+        values[_decode_oid(oid)] = value
+    return int.from_bytes(request_id, "big", signed=True), values
+
+
+def _to_metrics(values):
+    raw = {name: values.get(oid) for name, oid in METRIC_OIDS.items()}
+    metrics = {}
+    if raw["cpu_idle"] is not None:
+        metrics["cpu"] = 100 - raw["cpu_idle"]
+    if raw["load_1m"] is not None:
+        metrics["load"] = raw["load_1m"] / 100
+    if raw["mem_total"]:
+        used = raw["mem_total"] - sum(raw[name] or 0 for name in ("mem_available", "mem_buffer", "mem_cached"))
+        metrics["memory"] = 100 * used / raw["mem_total"]
+    return metrics
+
+
+class SnmpCollector:
+    """
+    Poll snmpd on every webserver and keep recent samples per host.
+
+    Each round sends one GET per host from a single UDP socket and collects
+    the answers as they arrive, so a round costs about one round trip no
+    matter how many hosts there are. Samples go into fixed-size ring buffers
+    of `history` entries per host.
+
+    Only the haproxy host can reach UDP 161 on the webservers, so site.yaml
+    runs this module there as the snmp-collector service, which writes a
+    snapshot to METRICS_PATH after every round.
+    """
+
+    def __init__(self, targets, community="public", history=360, timeout=2, retries=1):
+        self.targets = dict(targets)
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._samples = {host: deque(maxlen=history) for host in self.targets}
+        self._history = history
+
+    def set_targets(self, targets):
+        """
+        Follow pool membership changes, keeping history for hosts that stay.
+        """
+        with self._lock:
+            self.targets = dict(targets)
+            self._samples = {
+                host: self._samples.get(host, deque(maxlen=self._history))
+                for host in self.targets
+            }
+
+    def poll(self):
+        """
+        Run one polling round. Returns host -> metrics for the hosts that answered.
+        """
+        oids = list(METRIC_OIDS.values())
+        pending = {}
+        for host, address in self.targets.items():
+            pending[random.randint(1, 2**31 - 1)] = (host, address)
+        results = {}
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for _ in range(self.retries + 1):
+                if not pending:
+                    break
+                for request_id, (host, address) in pending.items():
+                    try:
+                        sock.sendto(build_get_request(self.community, request_id, oids), address)
+                    except OSError as e:
+                        logging.warning("Could not send SNMP request to %s: %s", host, e)
+                deadline = time.monotonic() + self.timeout
+                while pending and time.monotonic() < deadline:
+                    ready, _, _ = select.select([sock], [], [], deadline - time.monotonic())
+                    if not ready:
+                        break
+                    try:
+                        packet, _ = sock.recvfrom(65535)
+                        request_id, values = parse_response(packet)
+                    except (OSError, ValueError, IndexError) as e:
+                        logging.debug("Ignoring SNMP packet: %s", e)
+                        continue
+                    if request_id in pending:
+                        host, _ = pending.pop(request_id)
+                        results[host] = _to_metrics(values)
+
+        now = time.time()
+        with self._lock:
+            for host, metrics in results.items():
+                if host in self._samples:
+                    self._samples[host].append((now, metrics))
+        for host, _ in pending.values():
+            logging.warning("No SNMP answer from %s.", host)
+        return results
+
+    def run(self, interval=10, stop_event=None):
+        """
+        Poll every `interval` seconds until `stop_event` is set.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.poll()
+            stop_event.wait(max(0, interval - (time.monotonic() - started)))
+
+    def start(self, interval=10):
+        """
+        Poll in a background thread. Returns the event that stops it.
+        """
+        stop_event = threading.Event()
+        threading.Thread(target=self.run, args=(interval, stop_event), daemon=True).start()
+        return stop_event
+
+    def samples(self, host, minutes=None):
+        with self._lock:
+            samples = list(self._samples.get(host, []))
+        if minutes is None:
+            return samples
+        since = time.time() - minutes * 60
+        return [sample for sample in samples if sample[0] >= since]
+
+    def average(self, host, metric, minutes=5):
+        """
+        Average of `metric` ("cpu", "load" or "memory") for one host over the
+        last `minutes`, or None without samples.
+        """
+        values = [metrics[metric] for _, metrics in self.samples(host, minutes) if metric in metrics]
+        return sum(values) / len(values) if values else None
+
+    def pool_average(self, metric, minutes=5):
+        """
+        Average of the per-host averages over the last `minutes`.
+        """
+        averages = [self.average(host, metric, minutes) for host in list(self.targets)]
+        averages = [value for value in averages if value is not None]
+        return sum(averages) / len(averages) if averages else None
+
+    def snapshot(self, minutes=5):
+        """
+        Per-host and pool averages of every metric over the last `minutes`.
+        """
+        names = ("cpu", "load", "memory")
+        return {
+            "time": time.time(),
+            "minutes": minutes,
+            "hosts": {
+                host: {name: self.average(host, name, minutes) for name in names}
+                for host in list(self.targets)
+            },
+            "pool": {name: self.pool_average(name, minutes) for name in names},
+        }
+
+
+def targets_from_inventory(inventory_path, config_path, group="webservers", port=161):
+    """
+    Build collector targets (host -> (ip, port)) from the generated inventory.
+    """
+    # Imported here: the copy running on the haproxy host has no inventory.
+    from health_probe import read_inventory_groups, read_ssh_config
+
+    groups = read_inventory_groups(inventory_path)
+    ssh_hosts = read_ssh_config(config_path)
+    return {
+        host: (ssh_hosts.get(host, {}).get("HostName", host), port)
+        for host in groups.get(group, [])
+    }
+
+
+def targets_from_haproxy_cfg(path=HAPROXY_CFG, port=161):
+    """
+    Build collector targets from the server lines of the HAProxy config,
+    skipping the disabled slots kept for future webservers.
+    """
+    targets = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 3 and fields[0] == "server" and "disabled" not in fields[3:]:
+                targets[fields[1]] = (fields[2].rsplit(":", 1)[0], port)
+    return targets
+
+
+def write_snapshot(snapshot, path=METRICS_PATH):
+    """
+    Replace `path` with `snapshot` as JSON, so readers never see half a file.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics.")
+    with os.fdopen(fd, "w") as f:
+        json.dump(snapshot, f)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def read_collected_metrics(config_path, haproxy_host, path=METRICS_PATH, timeout=15):
+    """
+    Fetch the latest snapshot of the collector running on the haproxy host.
+    """
+    result = subprocess.run(
+        ["ssh", "-F", config_path, haproxy_host, f"cat {shlex.quote(path)}"],
+        text=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Reading SNMP metrics from {haproxy_host} failed: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+def main(haproxy_cfg=HAPROXY_CFG, output=METRICS_PATH, interval=10, community="public"):
+    """
+    Poll the webservers in HAProxy's rotation forever, following membership
+    changes through the config file, and write a snapshot after each round.
+    """
+    collector = SnmpCollector(targets_from_haproxy_cfg(haproxy_cfg), community=community)
+    while True:
+        started = time.monotonic()
+        try:
+            collector.set_targets(targets_from_haproxy_cfg(haproxy_cfg))
+        except OSError as e:
+            logging.error("Could not read %s, keeping the previous targets: %s", haproxy_cfg, e)
+        collector.poll()
+        try:
+            write_snapshot(collector.snapshot(), output)
+        except OSError as e:
+            logging.error("Could not write %s: %s", output, e)
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Poll snmpd on the webservers behind HAProxy and keep recent averages."
+    )
+    parser.add_argument(
+        "--haproxy-cfg",
+        type=str,
+        default=HAPROXY_CFG,
+        help="HAProxy config to read the webservers from"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=METRICS_PATH,
+        help="JSON file rewritten after every polling round"
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=10,
+        help="Seconds between polling rounds"
+    )
+    parser.add_argument(
+        "--community",
+        type=str,
+        default="public",
+        help="SNMPv2c community of the webservers"
+    )
+
+    args = parser.parse_args()
+    main(haproxy_cfg=args.haproxy_cfg, output=args.output, interval=args.interval, community=args.community)
@@ -0,0 +1,299 @@
+import re
+import time
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from infrastructure import create_servers, delete_servers, load_baked_image_id, abs_path
+from ansible_helper import run_incremental_playbook
+from readiness import ReadinessTracker
+from failure_handler import server_age
+from variables import IMAGE_NAME, WEBSERVER_USER_DATA
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Server metadata key telling a standby that can be promoted from one that
+# is still being built.
+POOL_STATE_KEY = "standby_state"
+
+# Status a parked standby ends in, per mode.
+PARKED_STATUSES = {
+    "stop": ("SHUTOFF",),
+    "shelve": ("SHELVED", "SHELVED_OFFLOADED"),
+}
+
+
+def standby_name_pattern(tag):
+    return re.compile(rf"^{tag}_standby\d+$")
+
+
+def wait_for_status(conn, server, statuses, timeout=600, interval=2):
+    """
+    Poll a server until its status is one of `statuses`.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        server = conn.compute.get_server(server)
+        if server.status in statuses:
+            return server
+        if server.status == "ERROR":
+            raise RuntimeError(f"Server '{server.name}' went to ERROR.")
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Server '{server.name}' still {server.status} after {timeout}s.")
+        time.sleep(interval)
+
+
+class StandbyPool:
+    """
+    Keep `size` configured webservers parked (stopped or shelved) outside the
+    HAProxy rotation so scale-up only has to start them.
+
+    Standbys are named "<tag>_standby<N>" and sit in the [standby] inventory
+    group. Promotion starts one and renames it to the webserver name it
+    replaces; demotion does the reverse for servers removed on scale-down.
+    Refills run in a background thread.
+    """
+
+    def __init__(self, reconciler, size, mode="stop", ready_timeout=600):
+        if mode not in PARKED_STATUSES:
+            raise ValueError(f"Unknown standby mode '{mode}', expected one of {', '.join(PARKED_STATUSES)}.")
+        self.reconciler = reconciler
+        self.conn = reconciler.conn
+        self.tag = reconciler.tag
+        self.size = size
+        self.mode = mode
+        self.ready_timeout = ready_timeout
+        self._pattern = standby_name_pattern(self.tag)
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+    def standbys(self):
+        return sorted(
+            (server for server in self.reconciler.cache.servers() if self._pattern.match(server.name)),
+            key=lambda server: server.name
+        )
+
+    def ready(self):
+        """
+        Parked standbys that finished configuration, in name order.
+        """
+        return [
+            server for server in self.standbys()
+            if (server.metadata or {}).get(POOL_STATE_KEY) == "ready"
+            and server.status in PARKED_STATUSES["stop"] + PARKED_STATUSES["shelve"]
+        ]
+
+    def _free_names(self, count):
+        taken = {server.name for server in self.standbys()}
+        names = []
+        i = 1
+        while len(names) < count:
+            name = f"{self.tag}_standby{i}"
+            if name not in taken:
+                names.append(name)
+            i += 1
+        return names
+
+    def _wake(self, server):
+        if server.status == "SHUTOFF":
+            self.conn.compute.start_server(server)
+        else:
+            self.conn.compute.unshelve_server(server)
+        return self.conn.compute.wait_for_server(server)
+
+    def _park(self, server):
+        if self.mode == "stop":
+            self.conn.compute.stop_server(server)
+        else:
+            self.conn.compute.shelve_server(server)
+        return wait_for_status(self.conn, server, PARKED_STATUSES[self.mode], timeout=self.ready_timeout)
+
+    def promote(self, names):
+        """
+        Turn ready standbys into the webservers `names`, starting them all
+        at once.
+
+        Returns:
+            list of the names that were filled by a standby.
+        """
+        with self._lock:
+            self.reconciler.cache.refresh_servers(force=True)
+            pairs = list(zip(names, self.ready()))
+            if not pairs:
+                return []
+            promoted = []
+            with ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+                futures = {}
+                for name, server in pairs:
+                    logging.info("Promoting standby %s to %s.", server.name, name)
+                    self.conn.compute.set_server_metadata(server, **{POOL_STATE_KEY: "promoted"})
+                    self.conn.compute.update_server(server, name=name)
+                    futures[executor.submit(self._wake, server)] = name
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        future.result()
+                        promoted.append(name)
+                    except Exception as e:
+                        logging.error("Standby promoted to %s did not start: %s", name, e)
+            self.reconciler.cache.invalidate()
+            return sorted(promoted)
+
+    def demote(self, servers):
+        """
+        Park as many of `servers` (already out of rotation) as the pool has
+        room for.
+
+        Returns:
+            list of the names that were demoted; the others are left to the caller.
+        """
+        with self._lock:
+            room = self.size - len(self.standbys())
+            if room <= 0:
+                return []
+            servers = servers[:room]
+            demoted = []
+            with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+                futures = {}
+                for server, standby_name in zip(servers, self._free_names(len(servers))):
+                    name = server.name
+                    logging.info("Demoting %s to standby %s.", name, standby_name)
+                    self.conn.compute.set_server_metadata(server, **{POOL_STATE_KEY: "parking"})
+                    self.conn.compute.update_server(server, name=standby_name)
+                    futures[executor.submit(self._park, server)] = (server, name)
+                for future in as_completed(futures):
+                    server, name = futures[future]
+                    try:
+                        future.result()
+                        self.conn.compute.set_server_metadata(server, **{POOL_STATE_KEY: "ready"})
+                        demoted.append(name)
+                    except Exception as e:
+                        logging.error("Could not park %s: %s", name, e)
+            self.reconciler.cache.invalidate()
+            return demoted
+
+    def _discard(self, servers, reason):
+        if not servers:
+            return
+        logging.warning("Deleting standbys %s: %s", ", ".join(server.name for server in servers), reason)
+        delete_servers(self.conn, servers, cache=self.reconciler.cache)
+
+    def purge_stale(self):
+        """
+        Delete standbys left half-built or half-parked, e.g. by a process
+        that died during a refill, once they are older than `ready_timeout`.
+        """
+        stale = [
+            server for server in self.standbys()
+            if (server.metadata or {}).get(POOL_STATE_KEY) in ("building", "parking")
+            and (server_age(server) or 0) > self.ready_timeout
+        ]
+        self._discard(stale, f"not ready after {self.ready_timeout} seconds")
+
+    def refill(self):
+        """
+        Build, configure and park standbys until the pool is full. Standbys
+        that fail on the way are deleted so they do not hold a pool slot.
+        """
+        with self._lock:
+            self.purge_stale()
+            missing = self.size - len(self.standbys())
+            if missing <= 0:
+                return
+            names = self._free_names(missing)
+        logging.info("Refilling the standby pool: %s", ", ".join(names))
+
+        baked_image_id = load_baked_image_id(self.tag)
+        if baked_image_id:
+            image, user_data = baked_image_id, None
+        else:
+            image = IMAGE_NAME
+            user_data = base64.b64encode(WEBSERVER_USER_DATA.encode()).decode()
+        created, failed = create_servers(
+            self.conn,
+            names,
+            self.tag,
+            self.reconciler.network,
+            self.reconciler.keypair,
+            self.reconciler.web_sg,
+            user_data=user_data,
+            cache=self.reconciler.cache,
+            image_name_or_id=image,
+            metadata={POOL_STATE_KEY: "building"}
+        )
+        if failed:
+            self.reconciler.cache.refresh_servers(force=True)
+            self._discard([server for server in self.standbys() if server.name in failed], "creation failed")
+        if not created:
+            return
+        server_names_ip_dict, _ = self.reconciler.write_config()
+
+        # Let the first boot finish before parking, and configure unbaked
+        # standbys as soon as each one accepts SSH.
+        configured = []
+
+        def configure(ready_hosts):
+            hosts, _ = run_incremental_playbook(
+                self.reconciler.inventory_path,
+                self.reconciler.config_path,
+                abs_path("./site.yaml"),
+                new_hosts=ready_hosts
+            )
+            configured.extend(hosts)
+
+        tracker = ReadinessTracker(
+            self.conn,
+            self.reconciler.config_path,
+            f"{self.tag}_bastion",
+            stages=("boot",) if baked_image_id else ("boot", "ssh"),
+            timeout=self.ready_timeout
+        )
+        tracker.wait(
+            created,
+            server_names_ip_dict,
+            on_ready=configured.extend if baked_image_id else configure
+        )
+        broken = [server for name, server in created.items() if name not in configured]
+        created = {name: created[name] for name in configured}
+
+        with ThreadPoolExecutor(max_workers=len(created) or 1) as executor:
+            futures = {executor.submit(self._park, server): (name, server) for name, server in created.items()}
+            for future in as_completed(futures):
+                name, server = futures[future]
+                try:
+                    future.result()
+                    self.conn.compute.set_server_metadata(server, **{POOL_STATE_KEY: "ready"})
+                    logging.info("Standby %s is ready.", name)
+                except Exception as e:
+                    logging.error("Could not park standby %s: %s", name, e)
+                    broken.append(server)
+        self._discard(broken, "never became ready")
+        self.reconciler.cache.invalidate()
+
+    def wait_for_refill(self, timeout=None):
+        """
+        Block until the background refill, if any, has finished.
+        """
+        if self._refill_thread:
+            self._refill_thread.join(timeout)
+
+    def refill_async(self):
+        """
+        Start a refill in the background unless one is already running.
+        """
+        if self._refill_thread and self._refill_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.refill()
+            except Exception as e:
+                logging.error("Standby refill failed: %s", e)
+
+        self._refill_thread = threading.Thread(target=run, name=f"standby-refill-{self.tag}", daemon=True)
+        self._refill_thread.start()
@@ -0,0 +1,257 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from infrastructure import abs_path
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    kind TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    name TEXT,
+    verified_at REAL
+);
+CREATE TABLE IF NOT EXISTS servers (
+    name TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    status TEXT,
+    fixed_ip TEXT,
+    floating_ip TEXT,
+    addresses TEXT,
+    metadata TEXT,
+    created_at TEXT,
+    health TEXT,
+    health_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# How each kind of base resource is fetched by ID to verify a stored record.
+RESOURCE_GETTERS = {
+    "keypair": lambda conn, id: conn.compute.get_keypair(id),
+    "network": lambda conn, id: conn.network.get_network(id),
+    "subnet": lambda conn, id: conn.network.get_subnet(id),
+    "router": lambda conn, id: conn.network.get_router(id),
+    "security_group:webservers": lambda conn, id: conn.network.get_security_group(id),
+}
+
+
+def state_file(tag):
+    """
+    Path of the SQLite state database of a tag.
+    """
+    return abs_path(f"./{tag}_state.db")
+
+
+def state_files(tag):
+    """
+    The database and the journal files SQLite keeps next to it.
+    """
+    path = state_file(tag)
+    return [path, f"{path}-wal", f"{path}-shm"]
+
+
+def _sdk_server(**attrs):
+    from openstack.compute.v2.server import Server
+
+    return Server.existing(**attrs)
+
+
+class StateStore:
+    """
+    What operate last knew about a tag, kept in SQLite so a restart does not
+    start from scratch: base resource IDs, servers with their fixed and
+    floating IPs, creation times and last-known health.
+
+    Records are only hints. Base resources are verified with one GET by ID
+    each, and restored servers seed the ResourceCache so the first refresh
+    is a `changes-since` query. Every write is one transaction.
+    """
+
+    def __init__(self, tag, path=None, server_factory=None):
+        self.tag = tag
+        self.path = path or state_file(tag)
+        self.server_factory = server_factory or _sdk_server
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements atomically; an exception rolls all of them back.
+        """
+        with self._lock, self._db:
+            yield self._db
+
+    def close(self):
+        self._db.close()
+
+    def resources(self):
+        with self._lock:
+            return {row["kind"]: dict(row) for row in self._db.execute("SELECT * FROM resources")}
+
+    def save_resources(self, resources):
+        """
+        Record base resources by kind, e.g. {"network": network}.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            for kind, resource in resources.items():
+                db.execute(
+                    "INSERT OR REPLACE INTO resources (kind, id, name, verified_at) VALUES (?, ?, ?, ?)",
+                    (kind, resource.id, getattr(resource, "name", None), now)
+                )
+
+    def forget_resources(self, kinds):
+        with self.transaction() as db:
+            db.executemany("DELETE FROM resources WHERE kind = ?", [(kind,) for kind in kinds])
+
+    def restore_resources(self, conn):
+        """
+        Fetch the recorded base resources by ID, in parallel. Records that no
+        longer resolve are dropped so the caller rediscovers them.
+
+        Returns:
+            dict kind -> resource for the records that are still valid.
+        """
+        records = {kind: row for kind, row in self.resources().items() if kind in RESOURCE_GETTERS}
+        if not records:
+            return {}
+
+        def fetch(kind):
+            try:
+                return RESOURCE_GETTERS[kind](conn, records[kind]["id"])
+            except Exception as e:
+                logging.warning("Stored %s %s could not be verified: %s", kind, records[kind]["id"], e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=len(records)) as executor:
+            restored = dict(zip(records, executor.map(fetch, records)))
+        stale = [kind for kind, resource in restored.items() if resource is None]
+        if stale:
+            self.forget_resources(stale)
+        return {kind: resource for kind, resource in restored.items() if resource is not None}
+
+    def servers(self):
+        """
+        Stored server records as a dict name -> row dict.
+        """
+        with self._lock:
+            return {row["name"]: dict(row) for row in self._db.execute("SELECT * FROM servers")}
+
+    def save_servers(self, servers, names_ips, changes_since=None):
+        """
+        Replace the server records with the current view in one transaction,
+        keeping the recorded health and floating IPs of servers that remain.
+
+        Args:
+            servers (list): Servers of the tag as listed from the cloud.
+            names_ips (dict): Name -> address used in the inventory.
+            changes_since (str): Marker the view is complete up to, see
+                ResourceCache.last_synced.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            names = [server.name for server in servers]
+            db.execute(
+                f"DELETE FROM servers WHERE name NOT IN ({', '.join('?' for _ in names)})",
+                names
+            )
+            for server in servers:
+                db.execute(
+                    """
+                    INSERT INTO servers (name, id, status, fixed_ip, addresses, metadata, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        id = excluded.id,
+                        status = excluded.status,
+                        fixed_ip = excluded.fixed_ip,
+                        addresses = excluded.addresses,
+                        metadata = excluded.metadata,
+                        created_at = excluded.created_at,
+                        updated_at = excluded.updated_at,
+                        health = CASE WHEN servers.id = excluded.id THEN servers.health END,
+                        floating_ip = CASE WHEN servers.id = excluded.id THEN servers.floating_ip END
+                    """,
+                    (
+                        server.name,
+                        server.id,
+                        server.status,
+                        names_ips.get(server.name),
+                        json.dumps(server.addresses or {}),
+                        json.dumps(dict(server.metadata or {})),
+                        getattr(server, "created_at", None),
+                        now,
+                    )
+                )
+            if changes_since:
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changes_since', ?)", (changes_since,))
+
+    def set_floating_ip(self, server, address):
+        with self.transaction() as db:
+            db.execute(
+                """
+                INSERT INTO servers (name, id, status, floating_ip, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET floating_ip = excluded.floating_ip
+                """,
+                (server.name, server.id, server.status, address, time.time())
+            )
+
+    def floating_ip(self, name):
+        record = self.servers().get(name)
+        return record["floating_ip"] if record else None
+
+    def record_health(self, reachable, unreachable):
+        """
+        Store the outcome of a probe round as each server's last-known health.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE servers SET health = ?, health_at = ? WHERE name = ?",
+                [("reachable", now, name) for name in reachable]
+                + [("unreachable", now, name) for name in unreachable]
+            )
+
+    def restore_servers(self):
+        """
+        Rebuild the recorded servers without calling the cloud.
+
+        Returns:
+            (servers, changes_since), or ([], None) if no complete view was saved.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'changes_since'").fetchone()
+        if not row:
+            return [], None
+        servers = [
+            self.server_factory(
+                id=record["id"],
+                name=record["name"],
+                status=record["status"],
+                addresses=json.loads(record["addresses"] or "{}"),
+                metadata=json.loads(record["metadata"] or "{}"),
+                created_at=record["created_at"]
+            )
+            for record in self.servers().values()
+        ]
+        return servers, row["value"]
@@ -3,11 +3,16 @@ import time
 import socket
 
 h_name = socket.gethostname()
-IP_addres = socket.gethostbyname(h_name)
+try:
+    IP_addres = socket.gethostbyname(h_name)
+except socket.gaierror:
+    IP_addres = "unknown"
+
+# Everything after the timestamp is fixed for the life of the process.
+SUFFIX = " Serving from "+h_name+" ("+IP_addres+")\n"
 
 app = flask.Flask(__name__)
 
 @app.route('/')
 def index():
-    Time= time.strftime("%H:%M:%S")
-    return Time+" Serving from "+h_name+" ("+IP_addres+")\n"
+    return time.strftime("%H:%M:%S") + SUFFIX
@@ -0,0 +1,49 @@
+from autoscaler import Autoscaler, pick_scale_down_victims
+
+
+def stats(sessions=0, queue=0, response_ms=0):
+    return {"sessions": sessions, "queue": queue, "response_ms": response_ms, "servers": {}}
+
+
+def test_scales_up_to_sessions_per_server():
+    autoscaler = Autoscaler(min_servers=1, max_servers=10, target_sessions=20)
+    assert autoscaler.desired_count(stats(sessions=90), current=2) == 5
+
+
+def test_queue_or_slow_responses_add_a_server():
+    autoscaler = Autoscaler(target_sessions=20, max_response_ms=500)
+    assert autoscaler.desired_count(stats(sessions=10, queue=1), current=2) == 3
+    autoscaler = Autoscaler(target_sessions=20, max_response_ms=500)
+    assert autoscaler.desired_count(stats(sessions=10, response_ms=800), current=2) == 3
+
+
+def test_scale_up_is_clamped_and_cools_down():
+    autoscaler = Autoscaler(max_servers=4, target_sessions=10, scale_up_cooldown=60)
+    assert autoscaler.desired_count(stats(sessions=100), current=2) == 4
+    # A second scale-up inside the cooldown keeps the current size.
+    assert autoscaler.desired_count(stats(sessions=100), current=4) == 4
+    assert autoscaler.desired_count(stats(sessions=100), current=3) == 3
+
+
+def test_scale_down_waits_for_hysteresis():
+    autoscaler = Autoscaler(min_servers=1, target_sessions=20, scale_down_utilization=0.6)
+    # 30 sessions need 2 servers, but 2 would run at 75% > 60%: stay at 3.
+    assert autoscaler.desired_count(stats(sessions=30), current=3) == 3
+    assert autoscaler.desired_count(stats(sessions=10), current=3) == 1
+
+
+def test_scale_down_cools_down_and_respects_minimum():
+    autoscaler = Autoscaler(min_servers=2, target_sessions=20, scale_down_cooldown=300)
+    assert autoscaler.desired_count(stats(), current=5) == 2
+    assert autoscaler.desired_count(stats(), current=4) == 4
+
+
+def test_victims_are_least_loaded_then_newest():
+    load = {"servers": {
+        "t_dev1": {"sessions": 5, "queue": 0},
+        "t_dev2": {"sessions": 0, "queue": 0},
+        "t_dev3": {"sessions": 0, "queue": 0},
+    }}
+    hosts = ["t_dev1", "t_dev2", "t_dev3", "t_dev4"]
+    assert pick_scale_down_victims(hosts, 2, load) == ["t_dev4", "t_dev3"]
+    assert pick_scale_down_victims(hosts, 1) == ["t_dev4"]
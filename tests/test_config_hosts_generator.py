@@ -0,0 +1,19 @@
+import os
+import stat
+
+from config_hosts_generator import _diff_hosts, _write_if_changed
+
+
+def test_write_keeps_the_previous_mode(tmp_path):
+    path = tmp_path / "hosts"
+    assert _write_if_changed(str(path), "a\n")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    os.chmod(path, 0o640)
+    assert not _write_if_changed(str(path), "a\n")
+    assert _write_if_changed(str(path), "b\n")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+def test_missing_ip_read_back_as_none_is_unchanged():
+    diff = _diff_hosts({"t_dev1": "None", "t_dev2": "10.0.0.2"}, {"t_dev1": None, "t_dev2": "10.0.0.3"})
+    assert diff == {"added": [], "removed": [], "changed": ["t_dev2"]}
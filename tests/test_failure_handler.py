@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import failure_handler
+from failure_handler import CircuitBreaker, confirm_failures
+
+
+class Cache:
+    def __init__(self, servers):
+        self._servers = {server.name: server for server in servers}
+
+    def refresh_servers(self, force=False):
+        pass
+
+    def find_server(self, name):
+        return self._servers.get(name)
+
+
+def server(name, status="ACTIVE", age=3600):
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=age)
+    return SimpleNamespace(name=name, status=status, created_at=created_at.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+
+def silence_probes(monkeypatch):
+    monkeypatch.setattr(failure_handler, "show_backend_servers", lambda *args: {})
+    monkeypatch.setattr(failure_handler, "read_ssh_config", lambda config_path: {})
+    monkeypatch.setattr(failure_handler, "probe_addresses",
+                        lambda config_path, bastion, targets: dict.fromkeys(targets, False))
+
+
+def test_young_and_promoted_servers_are_not_dead(monkeypatch):
+    silence_probes(monkeypatch)
+    cache = Cache([
+        server("t_dev1"),
+        server("t_dev2", age=30),
+        server("t_dev3"),
+        server("t_dev4", status="ERROR", age=30),
+    ])
+    dead, servers = confirm_failures(cache, "config", "t_haproxy", "t_bastion",
+                                     ["t_dev1", "t_dev2", "t_dev3", "t_dev4"], grace_hosts={"t_dev3"}, grace=600)
+    # A young server in ERROR is still dead.
+    assert dead == ["t_dev1", "t_dev4"]
+    assert set(servers) == {"t_dev1", "t_dev4"}
+
+
+def test_breaker_trips_on_mass_failure():
+    breaker = CircuitBreaker(max_fraction=0.5)
+    assert not breaker.allow(3, 4)
+    assert breaker.is_open()
+    assert not breaker.allow(1, 4)
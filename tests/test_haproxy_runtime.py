@@ -0,0 +1,58 @@
+import subprocess
+
+import pytest
+
+import haproxy_runtime
+from haproxy_runtime import FREE_SLOT_ADDR, plan_backend_changes, run_haproxy_commands, serving_slots, set_servers_state
+
+
+def slot(addr, op_state=2, admin_state=0):
+    return {"addr": addr, "op_state": op_state, "admin_state": admin_state}
+
+
+CURRENT = {
+    "t_dev1": slot("10.0.0.1"),
+    "t_dev2": slot("10.0.0.2"),
+    "t_dev3": slot(FREE_SLOT_ADDR, op_state=0, admin_state=1),
+}
+
+
+def test_plan_fills_free_slots_and_frees_removed_ones():
+    commands = [command for command, _ in plan_backend_changes(CURRENT, {"t_dev1": "10.0.0.9", "t_dev3": "10.0.0.3"})]
+    assert commands == [
+        "set server http_back/t_dev1 addr 10.0.0.9 port 5000",
+        "set server http_back/t_dev3 addr 10.0.0.3 port 5000",
+        "set server http_back/t_dev3 state ready",
+        "set server http_back/t_dev2 state maint",
+        "shutdown sessions server http_back/t_dev2",
+        f"set server http_back/t_dev2 addr {FREE_SLOT_ADDR} port 5000",
+    ]
+
+
+def test_plan_uses_no_haproxy_25_commands():
+    commands = plan_backend_changes(CURRENT, {"t_dev3": "10.0.0.3"})
+    assert not any(command.startswith(("add server", "del server")) for command, _ in commands)
+
+
+def test_unchanged_backend_needs_no_commands():
+    assert plan_backend_changes(CURRENT, {"t_dev1": "10.0.0.1", "t_dev2": "10.0.0.2"}) == []
+    assert set(serving_slots(CURRENT)) == {"t_dev1", "t_dev2"}
+
+
+def fake_ssh(monkeypatch, stdout, stderr=""):
+    monkeypatch.setattr(haproxy_runtime.subprocess, "run",
+                        lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, stdout, stderr))
+
+
+def test_outputs_are_split_per_command(monkeypatch):
+    marker = haproxy_runtime._END_MARKER
+    fake_ssh(monkeypatch, f"{marker} 0\nIP changed from '127.0.0.1' to '10.0.0.3'\n\n{marker} 0\n")
+    assert run_haproxy_commands("config", "t_haproxy", ["a", "b"]) == ["", "IP changed from '127.0.0.1' to '10.0.0.3'"]
+
+
+def test_failed_socat_is_not_an_empty_answer(monkeypatch):
+    marker = haproxy_runtime._END_MARKER
+    fake_ssh(monkeypatch, f"{marker} 0\n{marker} 1\n", "sudo: socat: command not found")
+    with pytest.raises(RuntimeError, match="socat"):
+        run_haproxy_commands("config", "t_haproxy", ["a", "b"])
+    assert not set_servers_state("config", "t_haproxy", ["t_dev1", "t_dev2"], "drain")
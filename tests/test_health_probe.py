@@ -0,0 +1,34 @@
+import threading
+import time
+
+import health_probe
+from health_probe import get_tunnel
+
+
+class FakeProc:
+    def poll(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def test_concurrent_ensure_starts_one_ssh(monkeypatch, tmp_path):
+    started = []
+
+    def popen(cmd, **kwargs):
+        started.append(cmd)
+        time.sleep(0.1)
+        return FakeProc()
+
+    monkeypatch.setattr(health_probe.subprocess, "Popen", popen)
+    monkeypatch.setattr(health_probe.socket, "create_connection", lambda *args, **kwargs: FakeProc())
+    monkeypatch.setattr(health_probe, "_tunnels", {})
+
+    config_path = str(tmp_path / "config")
+    threads = [threading.Thread(target=lambda: get_tunnel(config_path, "t_bastion").ensure()) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(started) == 1
@@ -0,0 +1,20 @@
+from infrastructure import parse_openrc
+
+
+def test_parse_openrc_applies_unset_in_order(tmp_path):
+    openrc = tmp_path / "openrc.sh"
+    openrc.write_text(
+        "export OS_AUTH_URL=https://keystone:5000/v3\n"
+        "export OS_TOKEN=old\n"
+        "unset OS_TOKEN OS_PROJECT_ID\n"
+        "export OS_PROJECT_ID='abc'\n"
+    )
+    variables, unset = parse_openrc(str(openrc))
+    assert variables == {"OS_AUTH_URL": "https://keystone:5000/v3", "OS_PROJECT_ID": "abc"}
+    assert unset == ["OS_TOKEN"]
+
+
+def test_parse_openrc_rejects_prompts(tmp_path):
+    openrc = tmp_path / "openrc.sh"
+    openrc.write_text('read -sr OS_PASSWORD_INPUT\nexport OS_PASSWORD=$OS_PASSWORD_INPUT\n')
+    assert parse_openrc(str(openrc)) is None
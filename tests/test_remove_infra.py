@@ -0,0 +1,30 @@
+from fake_openstack import FakeConnection
+from infra_plan import ensure_base_infrastructure
+from infrastructure import assign_or_get_floating_ip, create_servers
+from remove_infra import teardown
+
+
+def deploy(conn, tag, public_key):
+    keypair, network, _, _, security_groups = ensure_base_infrastructure(conn, tag, str(public_key))
+    created, _ = create_servers(conn, [f"{tag}_haproxy"], tag, network, keypair, security_groups["haproxy"])
+    return assign_or_get_floating_ip(conn, created[f"{tag}_haproxy"])
+
+
+def test_teardown_keeps_other_tags_ips_and_can_run_twice(tmp_path):
+    public_key = tmp_path / "id.pub"
+    public_key.write_text("ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAITestKey test@localhost\n")
+    conn = FakeConnection()
+    deploy(conn, "zzta", public_key)
+    deploy(conn, "zztb", public_key)
+    # An IP another deployment allocated but has not attached yet.
+    foreign = conn.network.create_ip(floating_network_id="public")
+
+    # A previous teardown removed the router interface but not the router.
+    conn.network.remove_interface_from_router(conn.network.find_router("zztarouter"),
+                                              subnet_id=conn.network.find_subnet("zztasubnet").id)
+
+    assert teardown(conn, "zzta") == []
+    assert teardown(conn, "zzta") == []
+    addresses = {fip.floating_ip_address for fip in conn.network.ips()}
+    assert foreign.floating_ip_address in addresses
+    assert len(addresses) == 2
@@ -0,0 +1,41 @@
+from fake_openstack import FakeConnection
+from infra_plan import ensure_base_infrastructure
+from infrastructure import assign_or_get_floating_ip, create_servers, delete_servers, get_floating_ip_for_server
+from resource_cache import ResourceCache, TagView
+
+
+def record(calls, name, method):
+    def wrapper(**filters):
+        calls.append((name, filters))
+        return method(**filters)
+    return wrapper
+
+
+def test_tag_invalidate_leaves_the_other_tags_alone(tmp_path):
+    public_key = tmp_path / "id.pub"
+    public_key.write_text("ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAITestKey test@localhost\n")
+    conn = FakeConnection()
+    keypair, network, _, _, security_groups = ensure_base_infrastructure(conn, "zzta", str(public_key))
+    create_servers(conn, ["zzta_haproxy", "zztb_dev1"], "zzta", network, keypair, security_groups["haproxy"])
+    cache = ResourceCache(conn, None, ttl=3600)
+    view_a, view_b = TagView(cache, "zzta"), TagView(cache, "zztb")
+    assert [server.name for server in view_b.servers()] == ["zztb_dev1"]
+    cache.refresh_network()
+
+    created, _ = create_servers(conn, ["zzta_dev1"], "zzta", network, keypair, security_groups["webservers"],
+                                cache=view_a)
+    fip = assign_or_get_floating_ip(conn, created["zzta_dev1"])
+    calls = []
+    conn.compute.servers = record(calls, "servers", conn.compute.servers)
+    conn.network.ports = record(calls, "ports", conn.network.ports)
+    conn.network.ips = record(calls, "ips", conn.network.ips)
+    assert {server.name for server in view_a.servers()} == {"zzta_haproxy", "zzta_dev1"}
+    assert get_floating_ip_for_server(conn, "zzta_dev1", cache=view_a) == [fip]
+    assert [server.name for server in view_b.servers()] == ["zztb_dev1"]
+
+    delete_servers(conn, [view_a.find_server("zzta_dev1")], cache=view_a)
+    assert view_a.find_server("zzta_dev1") is None
+    # Nova was only asked what changed for zzta's names, and Neutron only
+    # about those servers' ports: nothing was listed tenant-wide again.
+    assert [filters["name"] for name, filters in calls if name == "servers"] == ["^zzta_", "^zzta_"]
+    assert all(filters.keys() & {"device_id", "port_id"} for name, filters in calls if name != "servers")
@@ -0,0 +1,66 @@
+import os
+import time
+
+from scheduler import ReconcileScheduler
+
+
+def write_conf(path, count):
+    with open(path, "w") as f:
+        f.write(f"{count}\n")
+
+
+def test_wait_runs_on_timer_when_count_never_read(tmp_path):
+    conf = tmp_path / "servers.conf"
+    write_conf(conf, 3)
+    scheduler = ReconcileScheduler(str(conf), min_interval=0.2, watch_interval=0.05)
+    scheduler.report_pass(healthy=False)
+
+    started = time.monotonic()
+    assert scheduler.wait() == "timer"
+    assert time.monotonic() - started >= 0.15
+
+
+def test_wait_returns_early_when_conf_changes(tmp_path):
+    conf = tmp_path / "servers.conf"
+    write_conf(conf, 3)
+    scheduler = ReconcileScheduler(str(conf), min_interval=30, watch_interval=0.01)
+    assert scheduler.read_desired_count() == 3
+    scheduler.report_pass(healthy=True)
+
+    write_conf(conf, 5)
+    os.utime(conf, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    assert scheduler.wait() == "conf-changed"
+    assert scheduler.read_desired_count() == 5
+
+
+def test_interval_doubles_while_healthy_and_resets(tmp_path):
+    conf = tmp_path / "servers.conf"
+    write_conf(conf, 1)
+    scheduler = ReconcileScheduler(str(conf), min_interval=5, max_interval=15)
+    scheduler.report_pass(healthy=True)
+    assert scheduler.interval == 10
+    scheduler.report_pass(healthy=True)
+    assert scheduler.interval == 15
+    scheduler.report_pass(healthy=False)
+    assert scheduler.interval == 5
+
+
+def test_error_backoff_is_capped(tmp_path):
+    conf = tmp_path / "servers.conf"
+    write_conf(conf, 1)
+    scheduler = ReconcileScheduler(str(conf), base_backoff=2, max_backoff=10)
+    for _ in range(10):
+        assert 0 <= scheduler.report_error() <= 10
+
+
+def test_unreadable_conf_keeps_the_last_good_count(tmp_path):
+    conf = tmp_path / "servers.conf"
+    write_conf(conf, 4)
+    scheduler = ReconcileScheduler(str(conf))
+    assert scheduler.read_desired_count() == 4
+    conf.write_text("")
+    assert scheduler.read_desired_count() == 4
+    conf.write_text("six\n")
+    assert scheduler.read_desired_count() == 4
+    write_conf(conf, 6)
+    assert scheduler.read_desired_count() == 6
@@ -0,0 +1,17 @@
+from config_renderer import render_lb_configs
+from snmp_collector import SnmpCollector, targets_from_haproxy_cfg
+
+
+def test_targets_skip_free_haproxy_slots(tmp_path):
+    cfg = tmp_path / "haproxy.cfg"
+    cfg.write_text(render_lb_configs({"t_dev1": "10.0.0.1", "t_dev3": "10.0.0.3"}, "t_haproxy")["/etc/haproxy/haproxy.cfg"])
+    assert targets_from_haproxy_cfg(str(cfg)) == {"t_dev1": ("10.0.0.1", 161), "t_dev3": ("10.0.0.3", 161)}
+
+
+def test_snapshot_averages_hosts_and_pool():
+    collector = SnmpCollector({"t_dev1": ("10.0.0.1", 161), "t_dev2": ("10.0.0.2", 161)})
+    collector._samples["t_dev1"].extend([(0, {"cpu": 10}), (0, {"cpu": 30})])
+    collector._samples["t_dev2"].append((0, {"cpu": 60}))
+    snapshot = collector.snapshot(minutes=None)
+    assert snapshot["hosts"]["t_dev1"]["cpu"] == 20
+    assert snapshot["pool"]["cpu"] == 40
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import standby_pool
+from standby_pool import POOL_STATE_KEY, StandbyPool
+
+
+def standby(name, state, age):
+    return SimpleNamespace(name=name, status="ACTIVE", metadata={POOL_STATE_KEY: state}, age=age)
+
+
+def test_purge_deletes_only_stale_unfinished_standbys(monkeypatch):
+    servers = [
+        standby("t_standby1", "ready", 5000),
+        standby("t_standby2", "building", 5000),
+        standby("t_standby3", "building", 10),
+        standby("t_standby4", "parking", 5000),
+        standby("t_dev1", "building", 5000),
+    ]
+    reconciler = SimpleNamespace(conn=None, tag="t", cache=SimpleNamespace(servers=lambda: servers))
+    deleted = []
+    monkeypatch.setattr(standby_pool, "server_age", lambda server: server.age)
+    monkeypatch.setattr(standby_pool, "delete_servers",
+                        lambda conn, doomed, cache=None: deleted.extend(server.name for server in doomed))
+
+    StandbyPool(reconciler, 4, ready_timeout=600).purge_stale()
+    assert deleted == ["t_standby2", "t_standby4"]
@@ -5,11 +5,11 @@ EXTERNAL_NETWORK_NAME = "ext-net"
 
 HAPROXY_USER_DATA = """#!/bin/bash
 apt update
-apt install -y nginx haproxy
+apt install -y nginx haproxy socat
 """
 
 WEBSERVER_USER_DATA = """#!/bin/bash
 apt update
-apt install -y python3 python3-pip snmpd python3-flask
+apt install -y python3 python3-pip snmpd python3-flask gunicorn
 """
 